@@ -0,0 +1,316 @@
+import os
+import resource
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+# ---------- memory probes ----------
+
+_CGROUP_V2_LIMIT = "/sys/fs/cgroup/memory.max"
+_CGROUP_V1_LIMIT = "/sys/fs/cgroup/memory/memory.limit_in_bytes"
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_UNLIMITED_THRESHOLD = 1 << 60
+# RSS growth over one batch below this is allocator noise, not the batch
+_GROWTH_SLACK_BYTES = 1 << 20
+
+
+def read_rss_bytes() -> int:
+    """Current resident set size of this process, in bytes."""
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    # fallback: peak RSS (KiB on Linux) – pessimistic but never under-reports
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def read_memory_limit_bytes() -> Optional[int]:
+    """
+    Memory available to this container: cgroup v2, then cgroup v1, then physical RAM.
+    Returns None if nothing could be determined.
+    """
+    for path in (_CGROUP_V2_LIMIT, _CGROUP_V1_LIMIT):
+        try:
+            with open(path, "r", encoding="ascii") as f:
+                raw = f.read().strip()
+        except OSError:
+            continue
+        if raw == "max":
+            break
+        try:
+            value = int(raw)
+        except ValueError:
+            continue
+        if 0 < value < _UNLIMITED_THRESHOLD:
+            return value
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _process_memory_bytes(pid: str) -> int:
+    """PSS of one process (shared pages split between sharers), VmRSS if smaps_rollup is unavailable."""
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path, "r", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            continue
+    return 0
+
+
+def _descendants(pid: int) -> List[int]:
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r", encoding="ascii") as f:
+                # "pid (comm) state ppid ..." – comm may contain spaces/parens
+                parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    found, frontier = [], [pid]
+    while frontier:
+        children = [p for p, ppid in parents.items() if ppid in frontier]
+        found += children
+        frontier = children
+    return found
+
+
+def read_tree_memory_bytes() -> int:
+    """Memory of this process plus every descendant (spaCy n_process workers), in bytes."""
+    if not os.path.isdir("/proc/self"):
+        return read_rss_bytes()
+    return sum(_process_memory_bytes(str(pid)) for pid in ["self"] + _descendants(os.getpid()))
+
+
+class PeakMemorySampler:
+    """
+    Polls read_tree_memory_bytes() on a background thread while the block runs;
+    `peak` is the largest total seen (including the readings at entry and exit).
+    """
+
+    def __init__(self, interval_s: float = 0.05):
+        self.interval_s = interval_s
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        self.peak = max(self.peak, read_tree_memory_bytes())
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name="peak-memory", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+
+def _mib(n: int) -> str:
+    return f"{n / (1 << 20):,.0f} MiB"
+
+# ---------- controller ----------
+
+class AdaptiveBatchController:
+    """
+    Keeps the scoring loop under a memory target by resizing nlp.pipe batches
+    and the number of spaCy models held in memory at once.
+
+    - after every batch: shrink (halve) above the high watermark while RSS is still
+      growing, grow (x1.5) below the low watermark. RSS that sits above the target
+      without growing is the loaded shard / model (Python rarely hands memory back),
+      which smaller batches cannot lower, so the size is held instead of ratcheted
+      down to the floor
+    - batches are also cut by total characters, so one huge comment ends up
+      in a batch on its own instead of being packed with 31 others
+    - after every model group: re-plan how many models fit next to each other
+    """
+
+    def __init__(self,
+                 batch_size: int = 32,
+                 min_batch_size: int = 1,
+                 max_batch_size: int = 256,
+                 max_batch_chars: int = 64_000,
+                 target_fraction: float = 0.80,
+                 low_fraction: Optional[float] = None,
+                 max_models_in_flight: int = 1,
+                 limit_bytes: Optional[int] = None):
+        # low watermark follows the target (0.80 → 0.60) so a split target (shards sharing a box) stays valid
+        if low_fraction is None:
+            low_fraction = 0.75 * target_fraction
+        if not 0 < low_fraction < target_fraction <= 1:
+            raise ValueError("expected 0 < low_fraction < target_fraction <= 1")
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.batch_size = min(max(batch_size, self.min_batch_size), self.max_batch_size)
+        self.max_batch_chars = max_batch_chars
+        self.target_fraction = target_fraction
+        self.low_fraction = low_fraction
+        self.max_models_in_flight = max(1, max_models_in_flight)
+        self.models_in_flight = 1
+        self.limit_bytes = limit_bytes if limit_bytes is not None else read_memory_limit_bytes()
+        self.model_footprint_bytes: Optional[int] = None
+        self._last_rss: Optional[int] = None
+        self._holding = False
+        limit = _mib(self.limit_bytes) if self.limit_bytes else "unknown"
+        self._log(f"limit={limit} target={target_fraction:.0%} batch_size={self.batch_size} "
+                  f"max_models_in_flight={self.max_models_in_flight}")
+
+    @classmethod
+    def from_args(cls, args) -> "AdaptiveBatchController":
+        return cls(batch_size=args.batch_size,
+                   min_batch_size=args.min_batch_size,
+                   max_batch_size=args.max_batch_size,
+                   max_batch_chars=args.max_batch_chars,
+                   target_fraction=args.memory_target,
+                   low_fraction=getattr(args, "memory_low", None),
+                   max_models_in_flight=args.max_models_in_flight)
+
+    @staticmethod
+    def _log(msg: str):
+        print(f"[memory] {msg}")
+
+    @property
+    def target_bytes(self) -> Optional[int]:
+        return int(self.limit_bytes * self.target_fraction) if self.limit_bytes else None
+
+    # --- batch sizing ---
+
+    def batches(self, texts: List[str]) -> Iterator[Tuple[int, int]]:
+        """Yield [start, end) slices over texts, sized by the current batch size and char budget."""
+        start, n = 0, len(texts)
+        while start < n:
+            end, chars = start, 0
+            while end < n and end - start < self.batch_size:
+                size = len(texts[end])
+                if end > start and chars + size > self.max_batch_chars:
+                    break
+                chars += size
+                end += 1
+            yield start, end
+            start = end
+
+    def mark(self):
+        """Call before a scoring loop (models loaded): RSS growth is measured per batch from here."""
+        self._last_rss = read_rss_bytes()
+
+    def observe(self):
+        """Call after each batch; resizes the next batch based on RSS and its growth over the batch."""
+        if not self.limit_bytes:
+            return
+        rss = read_rss_bytes()
+        grew = self._last_rss is None or rss - self._last_rss > _GROWTH_SLACK_BYTES
+        self._last_rss = rss
+        used = rss / self.limit_bytes
+        old = self.batch_size
+        if used >= self.target_fraction and grew:
+            self._holding = False
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            if self.batch_size == old:
+                self._log(f"rss={_mib(rss)} ({used:.0%} of limit) still growing at min_batch_size={old}")
+        elif used >= self.target_fraction:
+            if not self._holding:
+                self._log(f"rss={_mib(rss)} ({used:.0%} of limit) above target but flat over the last batch; "
+                          f"holding batch_size={old}")
+                self._holding = True
+        elif used < self.low_fraction:
+            self._holding = False
+            self.batch_size = min(self.max_batch_size, max(self.batch_size + 1, int(self.batch_size * 1.5)))
+        if self.batch_size != old:
+            floor = " (min_batch_size)" if self.batch_size == self.min_batch_size else ""
+            self._log(f"rss={_mib(rss)} ({used:.0%} of limit) batch_size {old} -> {self.batch_size}{floor}")
+
+    def reset_batch_size(self, n: int):
+        """Start from a calibrated batch size (e.g. per model); observe() adapts from there."""
+        old = self.batch_size
+        self.batch_size = min(max(n, self.min_batch_size), self.max_batch_size)
+        if self.batch_size != old:
+            self._log(f"batch_size {old} -> {self.batch_size} (profile)")
+
+    def shrink_after_oom(self, failed_size: int) -> bool:
+        """Halve the batch size after a MemoryError; False if already at the minimum."""
+        if failed_size <= self.min_batch_size:
+            return False
+        old = self.batch_size
+        self.batch_size = max(self.min_batch_size, min(self.batch_size, failed_size // 2))
+        self._log(f"MemoryError on batch of {failed_size}; batch_size {old} -> {self.batch_size}")
+        return True
+
+    # --- models in flight ---
+
+    def record_model_load(self, rss_before: int, n_models: int):
+        """Estimate per-model footprint from the RSS delta of loading a group of models."""
+        if n_models <= 0:
+            return
+        delta = max(0, read_rss_bytes() - rss_before) // n_models
+        if delta:
+            # keep the largest estimate; models vary in size
+            self.model_footprint_bytes = max(delta, self.model_footprint_bytes or 0)
+
+    def plan_models_in_flight(self, baseline_rss: int) -> int:
+        """Decide how many models to load next, given RSS with no models loaded."""
+        old = self.models_in_flight
+        if self.max_models_in_flight == 1 or not self.target_bytes or not self.model_footprint_bytes:
+            self.models_in_flight = 1
+        else:
+            # leave the same share for inference activations as one model needs
+            room = self.target_bytes - baseline_rss
+            fits = room // (2 * self.model_footprint_bytes)
+            self.models_in_flight = int(min(self.max_models_in_flight, max(1, fits)))
+        if self.models_in_flight != old:
+            self._log(f"model footprint~{_mib(self.model_footprint_bytes or 0)} "
+                      f"models_in_flight {old} -> {self.models_in_flight}")
+        return self.models_in_flight
+
+    def plan_processes(self, n_process: int, rss: int) -> int:
+        """
+        How many nlp.pipe worker processes fit next to this process (rss, model loaded):
+        each worker holds its own model copy plus activations, outside this process's RSS.
+        """
+        if n_process <= 1:
+            return 1
+        if not self.target_bytes or not self.model_footprint_bytes:
+            self._log(f"model footprint unknown; n_process {n_process} -> 1")
+            return 1
+        fits = int((self.target_bytes - rss) // (2 * self.model_footprint_bytes))
+        planned = max(1, min(n_process, fits))
+        if planned != n_process:
+            self._log(f"model footprint~{_mib(self.model_footprint_bytes)} n_process {n_process} -> {planned}")
+        return planned
+
+    def pipe_batch_size(self, texts: List[str]) -> int:
+        """Batch size for one streaming nlp.pipe: the current size, capped by the char budget at mean length."""
+        mean_chars = max(1, sum(len(t) for t in texts) // max(1, len(texts)))
+        return max(self.min_batch_size, min(self.batch_size, self.max_batch_chars // mean_chars))
+
+
+def add_memory_args(parser):
+    g = parser.add_argument_group("memory / batching")
+    g.add_argument("--batch-size", type=int, default=32, help="Initial nlp.pipe batch size")
+    g.add_argument("--min-batch-size", type=int, default=1)
+    g.add_argument("--max-batch-size", type=int, default=256)
+    g.add_argument("--max-batch-chars", type=int, default=64_000,
+                   help="Cut a batch early once its texts exceed this many characters")
+    g.add_argument("--memory-target", type=float, default=0.80,
+                   help="Fraction of the container memory limit to stay under")
+    g.add_argument("--memory-low", type=float, default=None,
+                   help="Grow batches below this fraction (default: 0.75 x --memory-target)")
+    g.add_argument("--max-models-in-flight", type=int, default=1,
+                   help="Upper bound on spaCy models loaded at once (sequential mode)")
+    return g
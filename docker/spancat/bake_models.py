@@ -0,0 +1,76 @@
+"""
+Image-build step: download, extract and validate models into baked_models/ so tasks skip S3 at start.
+
+  python bake_models.py --models-json models.json --labels all
+  python bake_models.py --models-json models.json --labels Gratitude,Respect --no-recommend
+
+Every model is loaded with spacy.load and run once before it is recorded, so a broken
+archive fails the image build instead of a Fargate task. baked_models/manifest.json pins the
+bucket/key/ETag/VersionId each model was baked from; at run time a model is only taken from
+the image when models.json still points at the same bucket/key and its ETag is unchanged.
+"""
+import os, json, time, argparse
+from datetime import datetime
+
+import boto3
+import spacy
+
+from run_spancat_over_table import BAKED_MODELS_DIR, download_and_extract_model
+
+RECOMMEND_LABEL = "__recommend__"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models-json", required=True)
+    parser.add_argument("--labels", default="all", help="'all' or comma-separated labels from models.json")
+    parser.add_argument("--dest", default=BAKED_MODELS_DIR)
+    parser.add_argument("--recommend-model-s3-bucket", default="aws-emr-studio-977903982786-us-east-1")
+    parser.add_argument("--recommend-model-s3-key", default="ECU-trust-subdomains/recommend-test/model.tar.gz")
+    parser.add_argument("--no-recommend", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.models_json, "r", encoding="utf-8") as f:
+        model_map = json.load(f)
+    if args.labels != "all":
+        wanted = {l.strip() for l in args.labels.split(",") if l.strip()}
+        unknown = wanted - set(model_map)
+        if unknown:
+            raise SystemExit(f"unknown labels: {sorted(unknown)}")
+        model_map = {k: v for k, v in model_map.items() if k in wanted}
+    if not args.no_recommend:
+        model_map[RECOMMEND_LABEL] = {"bucket": args.recommend_model_s3_bucket, "key": args.recommend_model_s3_key}
+
+    s3 = boto3.client("s3")
+    baked = {}
+    for label, loc in model_map.items():
+        t0 = time.perf_counter()
+        local_dir = os.path.join(args.dest, label)
+        path = download_and_extract_model(loc["bucket"], loc["key"], local_dir, use_baked=False, s3_client=s3)
+        # archive is no longer needed once extracted
+        tar = os.path.join(local_dir, "model.tar.gz")
+        if os.path.exists(tar):
+            os.remove(tar)
+
+        nlp = spacy.load(path)
+        nlp("Validation text for the baked model.")
+        del nlp
+
+        head = s3.head_object(Bucket=loc["bucket"], Key=loc["key"])
+        baked[label] = {
+            "bucket": loc["bucket"],
+            "key": loc["key"],
+            "etag": head["ETag"],
+            "version_id": head.get("VersionId"),
+            "path": os.path.abspath(path),
+        }
+        print(f"[bake] {label}: ok in {time.perf_counter() - t0:.1f}s → {path}")
+
+    manifest = {"created": datetime.now().isoformat(timespec="seconds"), "spacy": spacy.__version__, "models": baked}
+    with open(os.path.join(args.dest, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[bake] baked {len(baked)} model(s) into {args.dest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Compaction stage that runs after the Map: merges every shard's scored parquet for a run into
+Hive-style partitions for Athena / Redshift Spectrum.
+
+  <output>/posted_date=YYYY-MM-DD/theme=<theme>/part-00000.parquet   (--date-part day)
+  <output>/posted_month=YYYY-MM/theme=<theme>/part-00000.parquet     (--date-part month)
+  <output>/manifest.json
+
+Rows are sorted by comment_unique_key inside each partition; files use zstd, dictionary
+encoding for low-cardinality string columns, column statistics and a fixed row-group size,
+so queries prune partitions first and row groups (min/max key) second.
+Partition columns are not repeated inside the files.
+
+Batch (multi-tenant) runs score many up_ids together; --tenants splits the shards by up_id
+and compacts each tenant into its own <output-root>/run_id=<tenant run_id>/ with its own manifest.
+--scored-root also gives each tenant its own scored/run_id=<tenant run_id>/ copy of its rows.
+"""
+import os, json, argparse
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import fsspec
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+SORT_KEY = "comment_unique_key"
+TENANT_KEY = "up_id"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+def _fs(path: str):
+    return fsspec.filesystem("s3" if path.startswith("s3://") else "file")
+
+def _join(prefix: str, *parts: str) -> str:
+    return "/".join([prefix.rstrip("/"), *parts])
+
+# ---------- read ----------
+
+def read_shard_files(input_prefix: str) -> Tuple[List[Tuple[str, pa.Table]], List[str]]:
+    """(path relative to input_prefix, table) for every non-empty shard file, and all file paths."""
+    fs = _fs(input_prefix)
+    root = fs._strip_protocol(input_prefix).rstrip("/") + "/"
+    # <shard>/_profile/ holds profiling artefacts (and --sample-profile-rows' partial output), not scored rows
+    files = sorted(p for p in fs.find(input_prefix)
+                   if p.lower().endswith((".parquet", ".pq")) and "/_profile/" not in p)
+    shards = []
+    for p in files:
+        with fs.open(p, "rb") as f:
+            t = pq.read_table(f)
+        # shards with no spans are written as column-less frames
+        if t.num_rows:
+            shards.append((p[len(root):] if p.startswith(root) else p.rsplit("/", 1)[-1], t))
+    return shards, files
+
+def find_partial_shards(input_prefix: str) -> List[str]:
+    """Shard dirs (relative to input_prefix) whose scorer only profiled a row sample (_profile/PARTIAL.json)."""
+    fs = _fs(input_prefix)
+    root = fs._strip_protocol(input_prefix).rstrip("/") + "/"
+    markers = sorted(p for p in fs.find(input_prefix) if p.endswith("/_profile/PARTIAL.json"))
+    partial = [p[len(root):-len("/_profile/PARTIAL.json")] if p.startswith(root) else p for p in markers]
+    if partial:
+        print(f"[warn] partial shard(s), sample-profile rows only: {', '.join(partial)}")
+    return partial
+
+def read_shards(input_prefix: str) -> Tuple[pa.Table, List[str]]:
+    """All non-empty shard files under input_prefix, concatenated (schemas unified)."""
+    shards, files = read_shard_files(input_prefix)
+    if not shards:
+        return pa.table({}), files
+    return pa.concat_tables([t for _, t in shards], promote_options="default"), files
+
+# ---------- partition ----------
+
+def _date_part(col: pa.ChunkedArray, granularity: str) -> pa.ChunkedArray:
+    if pa.types.is_temporal(col.type):
+        fmt = "%Y-%m-%d" if granularity == "day" else "%Y-%m"
+        return pc.strftime(col, format=fmt)
+    s = pc.cast(col, pa.string())
+    return pc.utf8_slice_codeunits(s, 0, 10 if granularity == "day" else 7)
+
+def _partition_slices(keys_a: List, keys_b: List) -> List[Tuple[int, int]]:
+    """[start, end) runs of equal (a, b) in already-sorted key lists."""
+    runs, start = [], 0
+    for i in range(1, len(keys_a) + 1):
+        if i == len(keys_a) or keys_a[i] != keys_a[start] or keys_b[i] != keys_b[start]:
+            runs.append((start, i))
+            start = i
+    return runs
+
+def _dictionary_columns(table: pa.Table, max_ratio: float = 0.5) -> List[str]:
+    """String columns whose distinct/rows ratio is low enough for dictionary pages to pay off."""
+    cols = []
+    n = max(1, table.num_rows)
+    for name, col in zip(table.column_names, table.columns):
+        if pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+            if pc.count_distinct(col).as_py() / n <= max_ratio:
+                cols.append(name)
+    return cols
+
+# ---------- write ----------
+
+def compact(input_prefix: str, output_prefix: str,
+            date_part: str = "day",
+            row_group_size: int = 128_000,
+            max_rows_per_file: int = 1_000_000,
+            run_id: str = "") -> Dict:
+    table, sources = read_shards(input_prefix)
+    return write_compacted(table, input_prefix, len(sources), output_prefix, date_part=date_part,
+                           row_group_size=row_group_size, max_rows_per_file=max_rows_per_file, run_id=run_id,
+                           partial_shards=find_partial_shards(input_prefix))
+
+def split_scored(shards: List[Tuple[str, pa.Table]], input_prefix: str, scored_root: str,
+                 tenant: Dict) -> int:
+    """
+    Write the tenant's rows of every shard to <scored_root>/run_id=<tenant run_id>/<same shard path>,
+    so each tenant also gets the usual per-run scored prefix. Returns the files written.
+    """
+    out = _join(scored_root, f"run_id={tenant['run_id']}")
+    if out.rstrip("/") == input_prefix.rstrip("/"):
+        return 0  # single-tenant run: the input already is the tenant's prefix
+    fs = _fs(out)
+    if fs.exists(out):
+        fs.rm(out, recursive=True)
+    written = 0
+    for rel, t in shards:
+        part = t.filter(pc.equal(t[TENANT_KEY], int(tenant[TENANT_KEY])))
+        if not part.num_rows:
+            continue
+        path = _join(out, rel)
+        fs.makedirs(path.rsplit("/", 1)[0], exist_ok=True)
+        with fs.open(path, "wb") as f:
+            pq.write_table(part, f, compression="zstd")
+        written += 1
+    return written
+
+def compact_tenants(input_prefix: str, output_root: str, tenants: List[Dict],
+                    date_part: str = "day",
+                    row_group_size: int = 128_000,
+                    max_rows_per_file: int = 1_000_000,
+                    scored_root: str = "") -> List[Dict]:
+    """
+    Split a batch run's shards by up_id; tenant {"up_id": 7168, "run_id": "r-up7168"} goes to
+    <output_root>/run_id=r-up7168/. Tenants without rows still get an (empty) manifest.
+    With scored_root, each tenant's scored rows are also written to <scored_root>/run_id=r-up7168/.
+    """
+    shards, sources = read_shard_files(input_prefix)
+    table = pa.concat_tables([t for _, t in shards], promote_options="default") if shards else pa.table({})
+    if table.num_rows and TENANT_KEY not in table.column_names:
+        raise ValueError(f"scored output has no {TENANT_KEY} column to split on")
+    partial = find_partial_shards(input_prefix)
+    manifests = []
+    for tenant in tenants:
+        part = table
+        if table.num_rows:
+            part = table.filter(pc.equal(table[TENANT_KEY], int(tenant[TENANT_KEY]))).drop_columns([TENANT_KEY])
+        if scored_root:
+            split_scored(shards, input_prefix, scored_root, tenant)
+        m = write_compacted(part, input_prefix, len(sources), _join(output_root, f"run_id={tenant['run_id']}"),
+                            date_part=date_part, row_group_size=row_group_size,
+                            max_rows_per_file=max_rows_per_file, run_id=tenant["run_id"], partial_shards=partial)
+        m[TENANT_KEY] = tenant[TENANT_KEY]
+        if scored_root:
+            m["scored_prefix"] = _join(scored_root, f"run_id={tenant['run_id']}") + "/"
+        manifests.append(m)
+    return manifests
+
+def write_compacted(table: pa.Table, input_prefix: str, source_files: int, output_prefix: str,
+                    date_part: str = "day",
+                    row_group_size: int = 128_000,
+                    max_rows_per_file: int = 1_000_000,
+                    run_id: str = "",
+                    partial_shards: List[str] = ()) -> Dict:
+    fs = _fs(output_prefix)
+    if fs.exists(output_prefix):
+        # derived data for this run only – rebuild from scratch so no stale partitions remain
+        fs.rm(output_prefix, recursive=True)
+
+    date_col = "posted_date" if date_part == "day" else "posted_month"
+    manifest = {
+        "run_id": run_id,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "source_prefix": input_prefix,
+        "source_files": source_files,
+        "partition_columns": [date_col, "theme"],
+        "sort_key": SORT_KEY,
+        "row_group_size": row_group_size,
+        "rows": table.num_rows,
+        "files": [],
+    }
+    if partial_shards:
+        # scored with --sample-profile-rows: only a row sample of these shards made it into the output
+        manifest["partial_shards"] = list(partial_shards)
+
+    if table.num_rows:
+        missing = {"posted_date", "theme", SORT_KEY} - set(table.column_names)
+        if missing:
+            raise ValueError(f"scored output is missing required columns: {sorted(missing)}")
+        table = table.append_column("__date", _date_part(table["posted_date"], date_part).fill_null(NULL_PARTITION))
+        table = table.set_column(table.column_names.index("theme"), "theme",
+                                 pc.cast(table["theme"], pa.string()).fill_null(NULL_PARTITION))
+        table = table.sort_by([("__date", "ascending"), ("theme", "ascending"), (SORT_KEY, "ascending")])
+
+        drop = ["__date", "theme"] + (["posted_date"] if date_part == "day" else [])
+        data_cols = [c for c in table.column_names if c not in drop]
+        dict_cols = _dictionary_columns(table.select(data_cols))
+        sort_idx = data_cols.index(SORT_KEY)
+
+        dates = table["__date"].to_pylist()
+        themes = table["theme"].to_pylist()
+        for start, end in _partition_slices(dates, themes):
+            d, theme = dates[start], themes[start]
+            part_dir = _join(output_prefix, f"{date_col}={d}", f"theme={theme}")
+            fs.makedirs(part_dir, exist_ok=True)
+            part = table.slice(start, end - start).select(data_cols)
+            for n, off in enumerate(range(0, part.num_rows, max_rows_per_file)):
+                chunk = part.slice(off, max_rows_per_file)
+                path = _join(part_dir, f"part-{n:05d}.parquet")
+                with fs.open(path, "wb") as f:
+                    pq.write_table(chunk, f,
+                                   row_group_size=row_group_size,
+                                   compression="zstd",
+                                   use_dictionary=dict_cols,
+                                   write_statistics=True,
+                                   sorting_columns=[pq.SortingColumn(sort_idx)])
+                keys = chunk[SORT_KEY]
+                manifest["files"].append({
+                    "path": path if path.startswith("s3://") else os.path.abspath(path),
+                    "partition": {date_col: d, "theme": theme},
+                    "rows": chunk.num_rows,
+                    "row_groups": -(-chunk.num_rows // row_group_size),
+                    "min_key": pc.min(keys).as_py(),
+                    "max_key": pc.max(keys).as_py(),
+                })
+
+    fs.makedirs(output_prefix, exist_ok=True)
+    with fs.open(_join(output_prefix, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return manifest
+
+# ---------- main ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact a run's scored shards into partitioned parquet")
+    parser.add_argument("--input-prefix", required=True, help="e.g. s3://<bucket>/trust_scoring/scored/run_id=<id>/")
+    parser.add_argument("--output-prefix", required=True,
+                        help="e.g. s3://<bucket>/trust_scoring/compacted/run_id=<id>/; with --tenants the "
+                             "root the per-tenant run_id=<...>/ prefixes go under")
+    parser.add_argument("--scored-root", default="",
+                        help="With --tenants: also write each tenant's scored rows to "
+                             "<scored-root>/run_id=<tenant run_id>/ (e.g. s3://<bucket>/trust_scoring/scored/)")
+    parser.add_argument("--run-id", default="")
+    parser.add_argument("--tenants", default="",
+                        help='JSON list [{"up_id": 7168, "run_id": "<id>-up7168"}, ...]: split by up_id')
+    parser.add_argument("--tenants-uri", default="",
+                        help="Local path or s3:// URI of a file holding the --tenants JSON (the Export "
+                             "Lambda's tenants.json; large batches outgrow an env override)")
+    parser.add_argument("--date-part", choices=["day", "month"], default="day")
+    parser.add_argument("--row-group-size", type=int, default=128_000)
+    parser.add_argument("--max-rows-per-file", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    tenants = json.loads(args.tenants) if args.tenants else None
+    if args.tenants_uri:
+        with _fs(args.tenants_uri).open(args.tenants_uri, "r") as f:
+            tenants = json.load(f)
+    if tenants:
+        for m in compact_tenants(args.input_prefix, args.output_prefix, tenants,
+                                 date_part=args.date_part, row_group_size=args.row_group_size,
+                                 max_rows_per_file=args.max_rows_per_file, scored_root=args.scored_root):
+            print(f"[compact] up_id={m[TENANT_KEY]}: {m['rows']} rows → {len(m['files'])} file(s) "
+                  f"under run_id={m['run_id']}")
+        return
+
+    m = compact(args.input_prefix, args.output_prefix, date_part=args.date_part,
+                row_group_size=args.row_group_size, max_rows_per_file=args.max_rows_per_file,
+                run_id=args.run_id)
+    print(f"[compact] {m['source_files']} shard file(s), {m['rows']} rows → "
+          f"{len(m['files'])} file(s) under {args.output_prefix}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os, io, json, re, time, uuid, argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_WS = re.compile(r"\s+")
+# first allocation / minimum growth step of vectors.f32, in rows
+_GROW_MIN = 1024
+
+def normalize_text(text: str) -> str:
+    """Cache key for a theme text: lower-cased, trimmed, whitespace collapsed."""
+    return _WS.sub(" ", str(text)).strip().lower()
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+def _fs(path: str):
+    import fsspec
+    return fsspec.filesystem("s3" if path.startswith("s3://") else "file")
+
+def _read_npz(fs, path: str) -> Tuple[List[str], np.ndarray]:
+    with fs.open(path, "rb") as f:
+        data = np.load(io.BytesIO(f.read()), allow_pickle=False)
+        return [str(k) for k in data["keys"]], np.asarray(data["vectors"], dtype=np.float32)
+
+def _write_npz(fs, path: str, keys: List[str], vectors: np.ndarray):
+    buf = io.BytesIO()
+    np.savez(buf, keys=np.array(keys, dtype=str), vectors=np.asarray(vectors, dtype=np.float32))
+    fs.makedirs(path.rsplit("/", 1)[0], exist_ok=True)
+    with fs.open(path, "wb") as f:
+        f.write(buf.getvalue())
+
+
+class EmbeddingCache:
+    """
+    Persistent sentence-embedding store for short texts (theme texts).
+
+    Layout under <root>/<model slug>/:
+      vectors.f32  – float32 memmap (rows, dim); grows with the entry count up to
+                     max_entries, rows reused on eviction
+      index.json   – {normalized text: [row, last_used]} plus model name / dim
+
+    Misses are encoded in one batch and written back; when full, the least recently
+    used 10% are evicted.
+
+    With an S3 prefix, <prefix>/<model slug>/ holds base.npz and deltas/*.npz (keys +
+    vectors of used rows only). Opening the cache merges base + deltas into the local
+    store; push() uploads only the entries this process encoded, as a new delta, so
+    parallel shards never overwrite each other. consolidate() folds the deltas into
+    base.npz once per run (the compaction task).
+    """
+
+    def __init__(self, root_dir: str, model_name: str,
+                 max_entries: int = 200_000, s3_prefix: Optional[str] = None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.dir = os.path.join(root_dir, _slug(model_name))
+        self.s3_prefix = s3_prefix.rstrip("/") + "/" + _slug(model_name) if s3_prefix else None
+        self._index_path = os.path.join(self.dir, "index.json")
+        self._vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.dim: Optional[int] = None
+        self._entries: Dict[str, List[int]] = {}
+        self._clock = 0
+        self._vectors: Optional[np.memmap] = None
+        self._next_row = 0            # rows below this have been handed out at least once
+        self._free: List[int] = []    # rows released by eviction
+        self._new: Dict[str, None] = {}  # encoded by this process, not yet pushed
+        self._dirty = False
+        self.hits = self.misses = 0
+
+        os.makedirs(self.dir, exist_ok=True)
+        self._load()
+        if self.s3_prefix:
+            self.pull()
+
+    # ---------- persistence ----------
+
+    def _load(self):
+        if not os.path.exists(self._index_path) or not os.path.exists(self._vectors_path):
+            return
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            idx = json.load(f)
+        if idx.get("model") != self.model_name:
+            print(f"[embcache] index is for {idx.get('model')!r}, not {self.model_name!r}; starting empty")
+            return
+        self.dim = idx["dim"]
+        self._clock = idx.get("clock", 0)
+        self._entries = idx["entries"]
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(idx["capacity"], self.dim))
+        self._next_row = 1 + max((entry[0] for entry in self._entries.values()), default=-1)
+        if self._vectors.shape[0] > self.max_entries:
+            self._shrink()
+        print(f"[embcache] loaded {len(self._entries)} embeddings from {self.dir}")
+
+    def _allocate(self, rows: int):
+        """(Re)map vectors.f32 with `rows` rows; the file is extended in place, existing rows kept."""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(rows * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def _shrink(self):
+        # max_entries was lowered: evict first, then rewrite the kept rows densely
+        if len(self._entries) > self.max_entries:
+            self._evict(len(self._entries) - self.max_entries)
+        old = np.array(self._vectors)
+        keep = sorted(self._entries.values(), key=lambda entry: entry[0])
+        rows = [entry[0] for entry in keep]
+        for row, entry in enumerate(keep):
+            entry[0] = row
+        self._vectors = None
+        os.remove(self._vectors_path)
+        self._allocate(max(1, len(keep)))
+        self._vectors[:len(keep)] = old[rows]
+        self._next_row, self._free = len(keep), []
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty or self._vectors is None:
+            return
+        self._vectors.flush()
+        idx = {"model": self.model_name, "dim": self.dim, "capacity": self._vectors.shape[0],
+               "clock": self._clock, "entries": self._entries}
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(idx, f)
+        os.replace(tmp, self._index_path)
+        self._dirty = False
+
+    def pull(self):
+        """Merge base.npz and every delta under the S3 prefix into the local store."""
+        fs = _fs(self.s3_prefix)
+        base = f"{self.s3_prefix}/base.npz"
+        paths = ([base] if fs.exists(base) else []) + sorted(fs.glob(f"{self.s3_prefix}/deltas/*.npz"))
+        added = 0
+        for path in paths:
+            keys, vectors = _read_npz(fs, path)
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                print(f"[embcache] {path}: dim {vectors.shape[1]} != {self.dim}, skipped")
+                continue
+            missing = [i for i, key in enumerate(keys) if key not in self._entries]
+            if missing:
+                self._store([keys[i] for i in missing], vectors[missing], new=False)
+                added += len(missing)
+        if paths:
+            print(f"[embcache] pulled {added} embeddings from {len(paths)} file(s) under {self.s3_prefix}")
+
+    def push(self):
+        """Save locally and upload this process's new entries as one delta (never overwrites)."""
+        self.save()
+        new = [key for key in self._new if key in self._entries]
+        if not self.s3_prefix or not new:
+            return
+        path = f"{self.s3_prefix}/deltas/{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}.npz"
+        _write_npz(_fs(path), path, new, self._vectors[[self._entries[key][0] for key in new]])
+        self._new = {}
+        print(f"[embcache] pushed {len(new)} new embeddings → {path}")
+
+    # ---------- lookups ----------
+
+    def _evict(self, n: int) -> List[int]:
+        oldest = sorted(self._entries.items(), key=lambda kv: kv[1][1])[:n]
+        for key, _ in oldest:
+            del self._entries[key]
+            self._new.pop(key, None)
+        return [entry[0] for _, entry in oldest]
+
+    def _free_rows(self, n: int) -> List[int]:
+        rows = self._free[:n]
+        del self._free[:n]
+        fresh = min(n - len(rows), self.max_entries - self._next_row)
+        if fresh > 0 and self._next_row + fresh > self._vectors.shape[0]:
+            grown = max(self._next_row + fresh, 2 * self._vectors.shape[0], _GROW_MIN)
+            self._allocate(min(self.max_entries, grown))
+        rows += range(self._next_row, self._next_row + max(0, fresh))
+        self._next_row += max(0, fresh)
+        if len(rows) < n:
+            need = n - len(rows)
+            self._free = self._evict(max(need, self.max_entries // 10))
+            rows += self._free[:need]
+            del self._free[:need]
+        return rows
+
+    def _store(self, keys: List[str], vectors: np.ndarray, new: bool = True):
+        if self._vectors is None:
+            self.dim = int(vectors.shape[1])
+            self._allocate(min(self.max_entries, max(len(keys), _GROW_MIN)))
+        if len(keys) > self.max_entries:
+            keys, vectors = keys[-self.max_entries:], vectors[-self.max_entries:]
+        for key, row, vec in zip(keys, self._free_rows(len(keys)), vectors):
+            self._vectors[row] = vec
+            self._clock += 1
+            self._entries[key] = [row, self._clock]
+            if new:
+                self._new[key] = None
+        self._dirty = True
+
+    def encode(self, texts: List[str], encoder, batch_size: int = 64) -> np.ndarray:
+        """
+        Embeddings for texts (shape (len(texts), dim), float32); only cache misses
+        are passed to encoder.encode, once per unique normalized text. The encoder sees
+        the first original text for each key (a cased model gets the casing), the
+        cache is keyed on the normalized one.
+        """
+        keys = [normalize_text(t) for t in texts]
+        originals: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in self._entries:
+                originals.setdefault(key, str(text))
+        misses = list(originals)
+        self.misses += len(misses)
+        self.hits += sum(1 for k in keys if k not in originals)
+        if misses:
+            vecs = encoder.encode(list(originals.values()), batch_size=batch_size,
+                                  show_progress_bar=False, convert_to_numpy=True)
+            self._store(misses, np.asarray(vecs, dtype=np.float32).reshape(len(misses), -1))
+        out = np.empty((len(keys), self.dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            entry = self._entries.get(key)
+            if entry is None:
+                # only when a single call has more unique misses than the cache holds
+                out[i] = np.asarray(encoder.encode(str(texts[i]), show_progress_bar=False), dtype=np.float32)
+                continue
+            self._clock += 1
+            entry[1] = self._clock
+            out[i] = self._vectors[entry[0]]
+        self._dirty = True  # recency changed
+        return out
+
+    def encode_one(self, text: str, encoder) -> np.ndarray:
+        return self.encode([text], encoder)[0]
+
+    def __len__(self):
+        return len(self._entries)
+
+# ---------- shared store maintenance ----------
+
+def consolidate(s3_prefix: str, model_name: str, max_entries: int = 200_000) -> int:
+    """
+    Fold deltas/*.npz into base.npz (later files win, capped at the most recent max_entries)
+    and delete the folded deltas. Run by one task per execution, after the shards finished.
+    """
+    prefix = s3_prefix.rstrip("/") + "/" + _slug(model_name)
+    fs = _fs(prefix)
+    base = f"{prefix}/base.npz"
+    deltas = sorted(fs.glob(f"{prefix}/deltas/*.npz"))
+    if not deltas:
+        return 0
+    merged: Dict[str, np.ndarray] = {}
+    for path in ([base] if fs.exists(base) else []) + deltas:
+        keys, vectors = _read_npz(fs, path)
+        for key, vec in zip(keys, vectors):
+            merged.pop(key, None)  # re-insert so the newest occurrence is last
+            merged[key] = vec
+    keys = list(merged)[-max_entries:]
+    _write_npz(fs, base, keys, np.stack([merged[k] for k in keys]))
+    for path in deltas:
+        fs.rm(path)
+    print(f"[embcache] consolidated {len(deltas)} delta(s) → {len(keys)} embeddings in {base}")
+    return len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold per-shard embedding cache deltas into base.npz")
+    parser.add_argument("--s3-prefix", required=True, help="Same prefix the scorer gets as --embedding-cache-s3")
+    parser.add_argument("--model-name", default="paraphrase-MiniLM-L6-v2")
+    parser.add_argument("--max-entries", type=int, default=200_000)
+    args = parser.parse_args()
+    consolidate(args.s3_prefix, args.model_name, args.max_entries)
+
+if __name__ == "__main__":
+    main()
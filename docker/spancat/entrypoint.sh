@@ -1,36 +1,80 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# container start; the scorer reports time-to-first-batch relative to this
+export SPANCAT_T0="${SPANCAT_T0:-$(date +%s.%N)}"
+
 cd /app
 
-: "${INPUT_PREFIX:?missing INPUT_PREFIX}"
+# Calibration sweep: writes a hardware profile the normal run picks up from PROFILE_DIR
+if [[ "${SPANCAT_MODE:-}" == "calibrate" ]]; then
+  : "${INPUT:?missing INPUT (sample shard for calibration)}"
+  cal_argv=( calibrate --input "$INPUT" --text-col "${TEXT_COL:-cleaned_comment}" --models-json "/app/models.json" )
+  [[ -n "${PROFILE_DIR:-}" ]]       && cal_argv+=( --profile-dir "$PROFILE_DIR" )
+  [[ -n "${CALIBRATE_LABELS:-}" ]]  && cal_argv+=( --labels "$CALIBRATE_LABELS" )
+  [[ -n "${CALIBRATE_ROWS:-}" ]]    && cal_argv+=( --sample-rows "$CALIBRATE_ROWS" )
+  echo "[spancat] running: python /app/run_spancat_over_table.py ${cal_argv[*]}"
+  exec python /app/run_spancat_over_table.py "${cal_argv[@]}"
+fi
+
+# Compaction: merge a run's scored shards into partitioned, sorted parquet + manifest
+if [[ "${SPANCAT_MODE:-}" == "compact" ]]; then
+  : "${INPUT_PREFIX:?missing INPUT_PREFIX (scored run prefix)}"
+  : "${OUTPUT_PREFIX:?missing OUTPUT_PREFIX (compacted run prefix)}"
+  cmp_argv=( --input-prefix "$INPUT_PREFIX" --output-prefix "$OUTPUT_PREFIX" --run-id "${RUN_ID:-}" )
+  [[ -n "${COMPACT_DATE_PART:-}" ]] && cmp_argv+=( --date-part "$COMPACT_DATE_PART" )
+  # JSON [{"up_id":..,"run_id":..}] → one run_id=<...>/ per tenant under OUTPUT_PREFIX; the state machine
+  # passes the Export Lambda's tenants.json by URI (COMPACT_TENANTS inline is for small manual runs)
+  [[ -n "${COMPACT_TENANTS:-}" ]]     && cmp_argv+=( --tenants "$COMPACT_TENANTS" )
+  [[ -n "${COMPACT_TENANTS_URI:-}" ]] && cmp_argv+=( --tenants-uri "$COMPACT_TENANTS_URI" )
+  # ... and each tenant's scored rows next to the batch's: scored/run_id=<tenant run_id>/
+  [[ -n "${COMPACT_TENANTS:-}${COMPACT_TENANTS_URI:-}" ]] && cmp_argv+=( --scored-root "${INPUT_PREFIX%/run_id=*}/" )
+  echo "[spancat] running: python /app/compact_scored.py ${cmp_argv[*]}"
+  python /app/compact_scored.py "${cmp_argv[@]}"
+  # single writer after the shards: fold their embedding cache deltas into the shared base
+  if [[ -n "${EMBEDDING_CACHE_S3:-}" ]]; then
+    python /app/embedding_cache.py --s3-prefix "$EMBEDDING_CACHE_S3"
+  fi
+  exit 0
+fi
+
+: "${SPANCAT_MODE:=}"
+# Direct (small-run) mode: the scorer pages the query result from the Redshift Data API itself;
+# RS_WORKGROUP / RS_DATABASE / DB_SECRET_ARN are read from the environment by the script
+if [[ "$SPANCAT_MODE" == "direct" ]]; then
+  : "${REDSHIFT_SQL_URI:?missing REDSHIFT_SQL_URI (direct mode)}"
+else
+  : "${INPUT_PREFIX:?missing INPUT_PREFIX}"
+fi
 : "${OUTPUT_PREFIX:?missing OUTPUT_PREFIX}"
 : "${TEXT_COL:=cleaned_comment}"
 : "${AWS_DEFAULT_REGION:=us-east-2}"
 
 echo "[spancat] Python: $(python -V)"
-echo "[spancat] spaCy:  $(python -c 'import spacy; print(spacy.__version__)')"
+# package metadata only – importing spacy here would cost seconds before any scoring
+echo "[spancat] spaCy:  $(python -c 'from importlib.metadata import version; print(version("spacy"))' 2>/dev/null || echo unknown)"
 echo "[spancat] CWD=$(pwd)"
 echo "[spancat] Files here: $(ls -1 | tr '\n' ' ')"
-echo "[spancat] INPUT_PREFIX=$INPUT_PREFIX"
+echo "[spancat] INPUT_PREFIX=${INPUT_PREFIX:-}"
 echo "[spancat] OUTPUT_PREFIX=$OUTPUT_PREFIX"
 echo "[spancat] TEXT_COL=$TEXT_COL"
 
 # Optional: exit success if no parquet files
-if command -v aws >/dev/null 2>&1; then
+if [[ "$SPANCAT_MODE" != "direct" ]] && command -v aws >/dev/null 2>&1; then
   if ! aws s3 ls "$INPUT_PREFIX" | grep -q '\.parquet'; then
     echo "[spancat] No parquet files under $INPUT_PREFIX — exiting success."
     exit 0
   fi
 fi
 
-# Try to discover which flags your script supports
-HELP_OUT="$(python /app/run_spancat_over_table.py --help 2>&1 || true)"
-echo "[spancat] detected help (first lines):"
-echo "$HELP_OUT" | head -n 40
+# Discover which flags the script supports from its source (no Python startup / heavy imports)
+HELP_OUT="$(grep -o -- '"--[A-Za-z_-]*"' /app/run_spancat_over_table.py | tr -d '"' | sort -u)"
+echo "[spancat] detected flags: $(tr '\n' ' ' <<<"$HELP_OUT")"
 
 # prefer single-file INPUT if provided; otherwise fall back to PREFIX
-if [[ -n "${INPUT:-}" ]]; then
+if [[ "$SPANCAT_MODE" == "direct" ]]; then
+  argv=( --redshift-sql-file "$REDSHIFT_SQL_URI" --output-prefix "$OUTPUT_PREFIX" )
+elif [[ -n "${INPUT:-}" ]]; then
   IN_FLAG="--input"
   OUT_FLAG="--output-prefix"
   argv=( "$IN_FLAG" "$INPUT" "$OUT_FLAG" "$OUTPUT_PREFIX" )
@@ -67,5 +111,20 @@ fi
 [[ -n "$TEXT_FLAG" ]] && argv+=( "$TEXT_FLAG" "$TEXT_COL" )
 argv+=( "${MODELS_JSON_ARG[@]}" "${THRESHOLDS_JSON_ARG[@]}" )
 
+# Optional memory / batching overrides (adaptive controller defaults otherwise)
+[[ -n "${BATCH_SIZE:-}" ]]           && argv+=( --batch-size "$BATCH_SIZE" )
+[[ -n "${MAX_BATCH_CHARS:-}" ]]      && argv+=( --max-batch-chars "$MAX_BATCH_CHARS" )
+[[ -n "${MEMORY_TARGET:-}" ]]        && argv+=( --memory-target "$MEMORY_TARGET" )
+[[ -n "${MAX_MODELS_IN_FLIGHT:-}" ]] && argv+=( --max-models-in-flight "$MAX_MODELS_IN_FLIGHT" )
+[[ -n "${PROFILE_DIR:-}" ]]          && argv+=( --profile-dir "$PROFILE_DIR" )
+[[ -n "${EMBEDDING_CACHE_S3:-}" ]]   && argv+=( --embedding-cache-s3 "$EMBEDDING_CACHE_S3" )
+
+# Opt-in sampling profiler: SAMPLE_PROFILE=1 (optional SAMPLE_PROFILE_ROWS, SAMPLE_PROFILE_INTERVAL_MS)
+if [[ "${SAMPLE_PROFILE:-0}" == "1" ]]; then
+  argv+=( --sample-profile )
+  [[ -n "${SAMPLE_PROFILE_ROWS:-}" ]]        && argv+=( --sample-profile-rows "$SAMPLE_PROFILE_ROWS" )
+  [[ -n "${SAMPLE_PROFILE_INTERVAL_MS:-}" ]] && argv+=( --sample-profile-interval-ms "$SAMPLE_PROFILE_INTERVAL_MS" )
+fi
+
 echo "[spancat] running: python /app/run_spancat_over_table.py ${argv[*]}"
 exec python /app/run_spancat_over_table.py "${argv[@]}"
@@ -0,0 +1,93 @@
+import os, json, math
+from datetime import datetime
+from typing import Dict, Optional
+
+from adaptive_batch import read_memory_limit_bytes
+
+PROFILE_DIR_DEFAULT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+# settings the scorer understands; anything else in a profile is ignored
+_SETTING_KEYS = ("torch_threads", "n_process", "batch_size")
+
+# ---------- hardware detection ----------
+
+def detect_cpus() -> int:
+    """vCPUs usable by this container: cgroup v2 quota, then affinity mask, then cpu_count."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="ascii") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def detect_hardware() -> Dict:
+    mem = read_memory_limit_bytes() or 0
+    return {"cpus": detect_cpus(), "memory_gib": round(mem / (1 << 30))}
+
+def profile_key(hw: Dict) -> str:
+    """e.g. cpu8-mem32g – one profile per Fargate task size."""
+    return f"cpu{hw['cpus']}-mem{hw['memory_gib']}g"
+
+# ---------- profile I/O (local dir or s3:// prefix) ----------
+
+def _profile_path(profile_dir: str, key: str) -> str:
+    return profile_dir.rstrip("/") + f"/{key}.json"
+
+def load_profile(profile_dir: str, hw: Optional[Dict] = None) -> Optional[Dict]:
+    """Profile for this hardware, or None if it has not been calibrated."""
+    hw = hw or detect_hardware()
+    path = _profile_path(profile_dir, profile_key(hw))
+    try:
+        if path.startswith("s3://"):
+            import s3fs
+            with s3fs.S3FileSystem().open(path, "r") as f:
+                return json.load(f)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_profile(profile_dir: str, hw: Dict, default: Dict, models: Dict[str, Dict]) -> str:
+    path = _profile_path(profile_dir, profile_key(hw))
+    profile = {
+        "hardware": hw,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "default": default,
+        "models": models,
+    }
+    body = json.dumps(profile, indent=2)
+    if path.startswith("s3://"):
+        import s3fs
+        with s3fs.S3FileSystem().open(path, "w") as f:
+            f.write(body)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(body)
+    return path
+
+def settings_for(profile: Optional[Dict], label: str) -> Dict:
+    """Per-model settings with the profile default as fallback; {} without a profile."""
+    if not profile:
+        return {}
+    merged = dict(profile.get("default") or {})
+    merged.update((profile.get("models") or {}).get(label) or {})
+    return {k: merged[k] for k in _SETTING_KEYS if k in merged}
+
+# ---------- applying settings ----------
+
+def set_torch_threads(n: Optional[int]):
+    """Set torch intra-op threads if torch is installed (it comes with spacy-transformers)."""
+    if not n:
+        return
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.get_num_threads() != n:
+        torch.set_num_threads(n)
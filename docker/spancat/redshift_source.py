@@ -0,0 +1,216 @@
+"""
+Small-run fast path: run the source query through the Redshift Data API and page
+get_statement_result straight into Arrow record batches, instead of UNLOAD → S3 → Map.
+
+Column types come from ColumnMetadata so every page has the same schema and dates/ints
+match what UNLOAD's parquet would have produced. FileRedshiftData is a file-backed stand-in
+for the Data API (UNLOAD, COUNT and plain SELECT) used by local/run_pipeline.py and
+--redshift-local-source.
+"""
+import os, re, time, uuid
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+
+_ARROW_TYPES = {
+    "int2": pa.int64(), "int4": pa.int64(), "int8": pa.int64(),
+    "smallint": pa.int64(), "integer": pa.int64(), "bigint": pa.int64(),
+    "float4": pa.float64(), "float8": pa.float64(), "real": pa.float64(), "double precision": pa.float64(),
+    "numeric": pa.float64(), "decimal": pa.float64(),
+    "bool": pa.bool_(), "boolean": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp("us"), "timestamptz": pa.timestamp("us", tz="UTC"),
+}
+
+# ---------- SQL helpers ----------
+
+# a quoted literal/identifier (kept) or a -- comment (dropped); '' and "" are escaped quotes
+_LITERAL_OR_COMMENT = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|--[^\n]*")
+
+def strip_statement(sql: str) -> str:
+    """
+    Drop -- comments and the trailing ';' so the query can be wrapped (COUNT, sub-select).
+    "--" inside quoted literals (LIKE '%--%') is kept.
+    """
+    sql = _LITERAL_OR_COMMENT.sub(lambda m: m.group(1) or "", sql)
+    return sql.strip().rstrip(";").strip()
+
+def count_sql(sql: str) -> str:
+    return f"SELECT COUNT(*) FROM (\n{strip_statement(sql)}\n) AS q"
+
+def wait_for_statement(rs, sid: str) -> Dict:
+    delay = 0.5
+    while True:
+        d = rs.describe_statement(Id=sid)
+        if d["Status"] in ("FINISHED", "FAILED", "ABORTED"):
+            if d["Status"] != "FINISHED":
+                raise RuntimeError(f"Redshift statement {sid} {d['Status']}: {d.get('Error')}")
+            return d
+        time.sleep(delay)
+        delay = min(delay * 1.5, 10.0)
+
+# ---------- result → Arrow ----------
+
+def _value(field: Dict, type_name: str):
+    if field.get("isNull"):
+        return None
+    for k in ("longValue", "doubleValue", "booleanValue", "blobValue"):
+        if k in field:
+            return field[k]
+    s = field.get("stringValue")
+    if s is None:
+        return None
+    if type_name == "date":
+        return date.fromisoformat(s)
+    if type_name.startswith("timestamp"):
+        return datetime.fromisoformat(s)
+    if type_name in ("numeric", "decimal"):
+        return float(s)
+    return s
+
+def records_to_batch(columns: List[Dict], records: List[List[Dict]]) -> pa.RecordBatch:
+    arrays, fields = [], []
+    for i, col in enumerate(columns):
+        type_name = (col.get("typeName") or "").lower()
+        typ = _ARROW_TYPES.get(type_name, pa.string())
+        arrays.append(pa.array([_value(r[i], type_name) for r in records], type=typ))
+        fields.append(pa.field(col.get("label") or col["name"], typ))
+    return pa.RecordBatch.from_arrays(arrays, schema=pa.schema(fields))
+
+def iter_statement_batches(rs, sid: str) -> Iterator[pa.RecordBatch]:
+    """One record batch per get_statement_result page."""
+    token = None
+    while True:
+        page = rs.get_statement_result(Id=sid, **({"NextToken": token} if token else {}))
+        if page.get("Records"):
+            yield records_to_batch(page["ColumnMetadata"], page["Records"])
+        token = page.get("NextToken")
+        if not token:
+            break
+
+def read_query(sql: str, rs=None, workgroup: str = "", database: str = "", secret_arn: str = "",
+               region: Optional[str] = None) -> pa.Table:
+    if rs is None:
+        import boto3
+        rs = boto3.client("redshift-data", region_name=region or os.environ.get("AWS_DEFAULT_REGION"))
+    sid = rs.execute_statement(Sql=strip_statement(sql), WorkgroupName=workgroup,
+                               Database=database, SecretArn=secret_arn)["Id"]
+    wait_for_statement(rs, sid)
+    batches = list(iter_statement_batches(rs, sid))
+    print(f"[redshift] {sum(b.num_rows for b in batches)} rows in {len(batches)} page(s) from statement {sid}")
+    return pa.Table.from_batches(batches) if batches else pa.table({})
+
+# ---------- file-backed stand-in ----------
+
+def _type_name(dtype, sample) -> str:
+    kind = getattr(dtype, "kind", "O")
+    if kind in "iu":
+        return "int8"
+    if kind == "f":
+        return "float8"
+    if kind == "b":
+        return "bool"
+    if kind == "M":
+        return "timestamp"
+    if isinstance(sample, date) and not isinstance(sample, datetime):
+        return "date"
+    return "varchar"
+
+def _field(v, type_name: str) -> Dict:
+    if v is None or (isinstance(v, float) and v != v):
+        return {"isNull": True}
+    if type_name == "int8":
+        return {"longValue": int(v)}
+    if type_name == "float8":
+        return {"doubleValue": float(v)}
+    if type_name == "bool":
+        return {"booleanValue": bool(v)}
+    if type_name in ("date", "timestamp"):
+        return {"stringValue": v.isoformat(sep=" ") if isinstance(v, datetime) else v.isoformat()}
+    return {"stringValue": str(v)}
+
+
+class FileRedshiftData:
+    """
+    Redshift Data API stand-in over a CSV/Parquet file that plays the role of the query result.
+
+    - UNLOAD ... TO '<prefix>' copies the rows into `slices` parts named like PARALLEL ON output
+    - SELECT COUNT(*) FROM (...) returns the row count, capped by a trailing LIMIT N) AS c
+      (the Export Lambda's bounded probe)
+    - any other statement returns the rows, paged by get_statement_result
+    Rows are filtered on up_id when the file has that column and the SQL has `up_id = N`
+    (every N, for batch runs' UNION ALL of tenants). A file without that column is returned
+    once per `CAST(N AS BIGINT) AS up_id` tag, with the up_id column added.
+    """
+
+    _TO = re.compile(r"TO\s+'([^']+)'", re.IGNORECASE)
+    _UP_ID = re.compile(r"up_id\s*=\s*(\d+)", re.IGNORECASE)
+    _TAG = re.compile(r"CAST\((\d+)\s+AS\s+BIGINT\)\s+AS\s+up_id", re.IGNORECASE)
+    _COUNT = re.compile(r"^\s*SELECT\s+COUNT\(\*\)\s+FROM\s*\(", re.IGNORECASE)
+    _COUNT_LIMIT = re.compile(r"LIMIT\s+(\d+)\)\s+AS\s+c\s*$", re.IGNORECASE)
+
+    def __init__(self, source: str, to_local: Callable[[str], str] = lambda p: p,
+                 slices: int = 4, page_size: int = 1000):
+        self.source = source
+        self.to_local = to_local
+        self.slices = max(1, slices)
+        self.page_size = page_size
+        self.statements: Dict[str, Dict] = {}
+        self._results: Dict[str, tuple] = {}
+
+    def _frame(self, sql: str):
+        import pandas as pd
+        df = pd.read_csv(self.source) if self.source.lower().endswith(".csv") else pd.read_parquet(self.source)
+        tags = [int(u) for u in self._TAG.findall(sql)]
+        if "up_id" in df.columns:
+            up_ids = set(tags) or {int(u) for u in self._UP_ID.findall(sql)}
+            if up_ids:
+                df = df[df["up_id"].isin(up_ids)]
+        elif tags:
+            # no tenant column: the file is every tenant's result, tagged like _tagged_sql's UNION ALL
+            df = pd.concat([df.assign(up_id=u) for u in tags], ignore_index=True)
+            df = df[["up_id"] + [c for c in df.columns if c != "up_id"]]
+        return df.reset_index(drop=True)
+
+    def execute_statement(self, Sql: str, **_):
+        sid = str(uuid.uuid4())
+        df = self._frame(Sql)
+        m = self._TO.search(Sql) if Sql.lstrip().upper().startswith("UNLOAD") else None
+        if m:
+            prefix = self.to_local(m.group(1))
+            os.makedirs(os.path.dirname(prefix), exist_ok=True)
+            step = -(-len(df) // self.slices) if len(df) else 0
+            for i in range(self.slices if step else 0):
+                part = df.iloc[i * step:(i + 1) * step]
+                if not part.empty:
+                    part.to_parquet(f"{prefix}{i:04d}_part_00.parquet", index=False)
+            rows = len(df)
+        elif self._COUNT.match(Sql):
+            limit = self._COUNT_LIMIT.search(Sql)
+            count = min(len(df), int(limit.group(1))) if limit else len(df)
+            self._results[sid] = ([{"name": "count", "typeName": "int8"}], [[{"longValue": count}]])
+            rows = 1
+        else:
+            cols = []
+            for c in df.columns:
+                non_null = df[c].dropna()
+                cols.append({"name": c, "typeName": _type_name(df[c].dtype, non_null.iloc[0] if len(non_null) else None)})
+            values = df.astype(object).where(df.notna(), None).values.tolist()
+            records = [[_field(v, col["typeName"]) for v, col in zip(row, cols)] for row in values]
+            self._results[sid] = (cols, records)
+            rows = len(records)
+        self.statements[sid] = {"Id": sid, "Status": "FINISHED", "ResultRows": rows}
+        return {"Id": sid}
+
+    def describe_statement(self, Id: str):
+        return self.statements[Id]
+
+    def get_statement_result(self, Id: str, NextToken: Optional[str] = None):
+        cols, records = self._results[Id]
+        start = int(NextToken or 0)
+        end = start + self.page_size
+        page = {"ColumnMetadata": cols, "Records": records[start:end], "TotalNumRows": len(records)}
+        if end < len(records):
+            page["NextToken"] = str(end)
+        return page
@@ -119,7 +119,7 @@ def fix_same_subdomain_overlapping_spans(spans_by_comment):
     return spans_by_comment
 
 @execution_time
-def fix_different_subdomain_overlapping_spans(spans_by_comment, embedding_model, knn_classifier, le):
+def fix_different_subdomain_overlapping_spans(spans_by_comment, embedding_model, knn_classifier, le, embedding_cache=None):
     """
     Apply a fix to spans from different subdomains.
 
@@ -130,6 +130,7 @@ def fix_different_subdomain_overlapping_spans(spans_by_comment, embedding_model,
         embedding_model: The SentenceTransformer model used for encoding theme text.
         knn_classifier: The k-nn classifier model for predicting subdomains.
         le: The label encoder for inverse transforming predicted subdomains.
+        embedding_cache (EmbeddingCache, optional): Persistent store consulted before encoding; only misses are encoded.
 
     Returns:
         dict: A dictionary with the same structure as 'spans_by_comment' but with updated spans after fixing different subdomain overlaps.
@@ -150,7 +151,10 @@ def fix_different_subdomain_overlapping_spans(spans_by_comment, embedding_model,
                             index = i
 
                         # Use k-nn classifier to determine which subdomain they belong to
-                        embedding = embedding_model.encode(theme_text, show_progress_bar=False)
+                        if embedding_cache is not None:
+                            embedding = embedding_cache.encode_one(theme_text, embedding_model)
+                        else:
+                            embedding = embedding_model.encode(theme_text, show_progress_bar=False)
                         predicted_theme = le.inverse_transform(knn_classifier.predict([embedding]))
                         if predicted_theme[0] in [spans[i]['theme_text'], spans[j]['theme_text']]:
                             spans[index]['theme'] = predicted_theme[0]
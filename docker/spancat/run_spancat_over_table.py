@@ -1,25 +1,49 @@
-import os, json, tarfile, argparse, re, sys
+import os, json, tarfile, argparse, re, sys, time
+# container start (exported by entrypoint.sh) so startup timings include shell + interpreter
+_T0 = float(os.environ.get("SPANCAT_T0") or time.time())
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Tuple, Set, Iterable
 
-import boto3
 import pandas as pd
-import s3fs
 import spacy
 
-# ---- added libs used by post-processing / recommend step ----
-from sentence_transformers import SentenceTransformer
-import joblib
-from run_filter_trust import (
-    time_fix_punctuation,
-    fix_same_subdomain_overlapping_spans,
-    fix_different_subdomain_overlapping_spans,
+# boto3 / s3fs and the post-processing libs (sentence_transformers, joblib, sklearn via
+# run_filter_trust) are imported where they are used, so startup only pays for spaCy + pandas
+from adaptive_batch import (
+    AdaptiveBatchController, PeakMemorySampler, add_memory_args, read_rss_bytes, read_memory_limit_bytes,
+)
+from embedding_cache import EmbeddingCache
+from sampling_profiler import SamplingProfiler, profile_dir_for
+from hardware_profile import (
+    PROFILE_DIR_DEFAULT, detect_hardware, profile_key, load_profile, save_profile,
+    settings_for, set_torch_threads,
 )
 
 import gc
 
+BAKED_MODELS_DIR = os.environ.get("BAKED_MODELS_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baked_models")
+
+# ---------- startup timing ----------
+
+_startup: Dict[str, float] = {}
+
+def startup_mark(name: str):
+    """Record the first time a milestone is reached, in seconds since container start."""
+    if name not in _startup:
+        _startup[name] = round(time.time() - _T0, 3)
+        print(f"[startup] {name}: {_startup[name]:.2f}s")
+
+startup_mark("imports")
+
 # ---------- I/O helpers ----------
 
+def _s3fs():
+    import s3fs
+    return s3fs.S3FileSystem()
+
 def _is_s3(p: str) -> bool:
     return p.startswith("s3://")
 
@@ -31,7 +55,7 @@ def _is_prefix(p: str) -> bool:
     return p.endswith("/") or not _has_ext(p)
 
 def list_s3_objects(prefix: str, exts=(".parquet", ".pq", ".csv")) -> List[str]:
-    fs = s3fs.S3FileSystem()
+    fs = _s3fs()
     # s3fs.ls returns keys without scheme for bucket roots sometimes; normalize
     paths = []
     for key in fs.ls(prefix):
@@ -42,7 +66,7 @@ def list_s3_objects(prefix: str, exts=(".parquet", ".pq", ".csv")) -> List[str]:
 
 def read_table(path: str) -> pd.DataFrame:
     if _is_s3(path):
-        fs = s3fs.S3FileSystem()
+        fs = _s3fs()
         ext = os.path.splitext(path)[1].lower()
         with fs.open(path, "rb") as f:
             if ext in [".parquet", ".pq"]:
@@ -60,10 +84,38 @@ def read_table(path: str) -> pd.DataFrame:
         else:
             raise ValueError(f"Unsupported extension: {ext} for {path}")
 
+def read_text(path: str) -> str:
+    if _is_s3(path):
+        with _s3fs().open(path, "r") as f:
+            return f.read()
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+REDSHIFT_INPUT = "redshift-data://"
+
+def read_redshift(args) -> pd.DataFrame:
+    """--redshift-sql(-file): page the statement result into Arrow batches (redshift_source), one frame."""
+    from redshift_source import FileRedshiftData, read_query
+    sql = args.redshift_sql or read_text(args.redshift_sql_file)
+    rs = FileRedshiftData(args.redshift_local_source) if args.redshift_local_source else None
+    table = read_query(sql, rs=rs, workgroup=args.redshift_workgroup,
+                       database=args.redshift_database, secret_arn=args.redshift_secret_arn)
+    return table.to_pandas()
+
+def write_text(text: str, path: str):
+    if _is_s3(path):
+        fs = _s3fs()
+        with fs.open(path, "w") as f:
+            f.write(text)
+    else:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
 def write_table(df: pd.DataFrame, path: str):
     ext = os.path.splitext(path)[1].lower()
     if _is_s3(path):
-        fs = s3fs.S3FileSystem()
+        fs = _s3fs()
         with fs.open(path, "wb") as f:
             if ext in [".parquet", ".pq"]:
                 df.to_parquet(f, index=False)
@@ -80,50 +132,130 @@ def write_table(df: pd.DataFrame, path: str):
             raise ValueError(f"Unsupported extension: {ext}")
 
 # ---------- model loading (SpanCat) ----------
+def _span_rows(doc, base: Dict, label: str, th: float, exclusion: Set[str], today: str) -> Iterable[Dict]:
+    if "sc" in doc.spans and "scores" in doc.spans["sc"].attrs:
+        for span, score in zip(doc.spans["sc"], doc.spans["sc"].attrs["scores"]):
+            if float(score) >= th and span.text.lower() not in exclusion:
+                out = dict(base)
+                out.update({
+                    "theme": label,
+                    "theme_text": span.text,
+                    "theme_start_char": int(span.start_char),
+                    "theme_end_char": int(span.end_char),
+                    "theme_start_token": int(span.start),
+                    "theme_end_token": int(span.end),
+                    "score": float(score),
+                    "relevant": 1,
+                    "pattern_check_date": today,
+                })
+                yield out
+
+def _score_batch(nlp, label: str, th: float,
+                 texts: List[str], bases: List[Dict], start: int, end: int,
+                 exclusion: Set[str], today: str, out: List[Dict],
+                 controller: AdaptiveBatchController):
+    """
+    Score texts[start:end]; on MemoryError split the batch down to single rows, and skip
+    only a row that still fails on its own.
+    """
+    try:
+        docs = list(nlp.pipe(texts[start:end], batch_size=end - start))
+    except MemoryError:
+        gc.collect()
+        if end - start == 1:
+            print(f"[warn] {label}: skipping row {start} ({len(texts[start])} chars) after MemoryError")
+            return
+        # later batches start smaller (not below min_batch_size); this one is split regardless
+        controller.shrink_after_oom(end - start)
+        mid = start + (end - start) // 2
+        _score_batch(nlp, label, th, texts, bases, start, mid, exclusion, today, out, controller)
+        _score_batch(nlp, label, th, texts, bases, mid, end, exclusion, today, out, controller)
+        return
+    for doc, base in zip(docs, bases[start:end]):
+        out.extend(_span_rows(doc, base, label, th, exclusion, today))
+
+def _score_multiprocess(nlp, label: str, th: float, texts: List[str], bases: List[Dict],
+                        batch_size: int, n_process: int,
+                        exclusion: Set[str], today: str, out: List[Dict]):
+    """Calibrated n_process > 1: one streaming nlp.pipe over all rows (workers start once per model)."""
+    for doc, base in zip(nlp.pipe(texts, batch_size=batch_size, n_process=n_process), bases):
+        out.extend(_span_rows(doc, base, label, th, exclusion, today))
+
 def process_table_sequential(df: pd.DataFrame,
                              text_col: str,
                              model_map: Dict[str, Dict[str, str]],
                              thresholds: Dict[str, float],
-                             exclusion: Set[str]) -> pd.DataFrame:
-    """Memory-friendly: load one model at a time, run over all rows, then free it."""
-    all_rows = []
+                             exclusion: Set[str],
+                             controller: AdaptiveBatchController | None = None,
+                             profile: Dict | None = None) -> pd.DataFrame:
+    """
+    Memory-friendly: load a few models at a time (one by default), run over all rows, then free them.
+    Batch size and models in flight are driven by the AdaptiveBatchController;
+    a calibration profile (if any) sets the starting torch threads / n_process / batch size per model.
+    """
+    controller = controller or AdaptiveBatchController()
     today = datetime.now().strftime("%Y-%m-%d")
 
     # pre-extract all model archives once (no memory cost, just disk)
-    local_paths = {}
-    for label, loc in model_map.items():
-        local_paths[label] = download_and_extract_model(loc["bucket"], loc["key"], f".cache/{label}")
+    local_paths = prepare_models(model_map)
 
     texts = df[text_col].fillna("").astype(str).tolist()
     bases = df.to_dict(orient="records")
 
-    for label, model_dir in local_paths.items():
-        th = thresholds.get(label, 0.5)
-        nlp = spacy.load(model_dir)
+    # keep output ordered by model, then by row, whatever the grouping
+    rows_by_label: Dict[str, List[Dict]] = {label: [] for label in local_paths}
+    labels = list(local_paths)
+    i = 0
+    while i < len(labels):
+        gc.collect()
+        baseline = read_rss_bytes()
+        group = labels[i:i + controller.plan_models_in_flight(baseline)]
+        models = {}
         try:
-            for doc, base in zip(nlp.pipe(texts, batch_size=32), bases):
-                if "sc" in doc.spans and "scores" in doc.spans["sc"].attrs:
-                    for span, score in zip(doc.spans["sc"], doc.spans["sc"].attrs["scores"]):
-                        if float(score) >= th and span.text.lower() not in exclusion:
-                            out = dict(base)
-                            out.update({
-                                "theme": label,
-                                "theme_text": span.text,
-                                "theme_start_char": int(span.start_char),
-                                "theme_end_char": int(span.end_char),
-                                "theme_start_token": int(span.start),
-                                "theme_end_token": int(span.end),
-                                "score": float(score),
-                                "relevant": 1,
-                                "pattern_check_date": today,
-                            })
-                            all_rows.append(out)
+            for label in group:
+                models[label] = spacy.load(local_paths[label])
+            startup_mark("first_model_loaded")
+            controller.record_model_load(baseline, len(group))
+
+            settings = [settings_for(profile, label) for label in group]
+            set_torch_threads(max((st.get("torch_threads", 0) for st in settings), default=0))
+            batch_sizes = [st["batch_size"] for st in settings if "batch_size" in st]
+            if batch_sizes:
+                controller.reset_batch_size(min(batch_sizes))
+            n_process = min((st.get("n_process", 1) for st in settings), default=1) if len(group) == 1 else 1
+            if n_process > 1:
+                # worker processes each load a model copy: only as many as the memory target allows
+                n_process = controller.plan_processes(n_process, read_rss_bytes())
+            if n_process > 1:
+                label = group[0]
+                out = rows_by_label[label]
+                done = len(out)
+                controller.mark()
+                try:
+                    _score_multiprocess(models[label], label, thresholds.get(label, 0.5), texts, bases,
+                                        controller.pipe_batch_size(texts), n_process, exclusion, today, out)
+                    controller.observe()
+                    startup_mark("first_batch")
+                except MemoryError:
+                    del out[done:]
+                    gc.collect()
+                    print(f"[warn] {label}: MemoryError with n_process={n_process}; rescoring in-process")
+                    n_process = 1
+            if n_process == 1:
+                controller.mark()
+                for start, end in controller.batches(texts):
+                    for label in group:
+                        _score_batch(models[label], label, thresholds.get(label, 0.5), texts, bases, start, end,
+                                     exclusion, today, rows_by_label[label], controller)
+                    controller.observe()
+                    startup_mark("first_batch")
         finally:
-            # free RAM used by this model before moving to the next
-            del nlp
+            # free RAM used by these models before moving to the next group
+            models.clear()
             gc.collect()
+        i += len(group)
 
-    return pd.DataFrame(all_rows)
+    return pd.DataFrame([row for label in labels for row in rows_by_label[label]])
 
 
 def load_exclusion_list(file_path: str) -> Set[str]:
@@ -132,15 +264,7 @@ def load_exclusion_list(file_path: str) -> Set[str]:
     with open(file_path, "r", encoding="utf-8") as f:
         return {line.strip().lower() for line in f if line.strip()}
 
-def download_and_extract_model(s3_bucket: str, s3_key: str, local_dir: str) -> str:
-    """
-    Downloads model.tar.gz from S3 and returns path to extracted pipeline dir.
-    """
-    os.makedirs(local_dir, exist_ok=True)
-    local_tar = os.path.join(local_dir, "model.tar.gz")
-    boto3.client("s3").download_file(s3_bucket, s3_key, local_tar)
-    with tarfile.open(local_tar, "r:gz") as tar:
-        tar.extractall(local_dir)
+def _find_model_dir(local_dir: str) -> str | None:
     # common export names: ./model-last or ./model-best
     for name in ["model-last", "model-best"]:
         candidate = os.path.join(local_dir, name)
@@ -150,7 +274,84 @@ def download_and_extract_model(s3_bucket: str, s3_key: str, local_dir: str) -> s
     for root, dirs, files in os.walk(local_dir):
         if "config.cfg" in files:
             return root
-    raise RuntimeError("Could not find extracted spaCy model folder")
+    return None
+
+_baked_manifest: Dict | None = None
+
+def _baked_models() -> Dict[str, Dict]:
+    global _baked_manifest
+    if _baked_manifest is None:
+        path = os.path.join(BAKED_MODELS_DIR, "manifest.json")
+        _baked_manifest = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                _baked_manifest = json.load(f)
+    return _baked_manifest.get("models") or {}
+
+def baked_model_dir(s3_bucket: str, s3_key: str, etag: str) -> str | None:
+    """
+    Model baked into the image by bake_models.py for this bucket/key, if the archive in S3 is
+    still the one it was baked from (retraining overwrites the same key).
+    """
+    for label, entry in _baked_models().items():
+        if entry["bucket"] != s3_bucket or entry["key"] != s3_key or not os.path.isdir(entry["path"]):
+            continue
+        if entry.get("etag") != etag:
+            print(f"[warn] baked model {label} is stale (s3://{s3_bucket}/{s3_key} ETag "
+                  f"{entry.get('etag')} -> {etag}); downloading from S3 instead")
+            return None
+        return entry["path"]
+    return None
+
+def download_and_extract_model(s3_bucket: str, s3_key: str, local_dir: str,
+                               use_baked: bool = True, s3_client=None) -> str:
+    """
+    Downloads model.tar.gz from S3 and returns path to extracted pipeline dir.
+    A baked-in model or an earlier extract in local_dir is reused while the archive's ETag is unchanged.
+    """
+    if s3_client is None:
+        import boto3
+        s3_client = boto3.client("s3")
+    etag = s3_client.head_object(Bucket=s3_bucket, Key=s3_key)["ETag"]
+    if use_baked:
+        baked = baked_model_dir(s3_bucket, s3_key, etag)
+        if baked:
+            return baked
+
+    marker = os.path.join(local_dir, ".source.json")
+    source = {"bucket": s3_bucket, "key": s3_key, "etag": etag}
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as f:
+            found = _find_model_dir(local_dir) if json.load(f) == source else None
+        if found:
+            return found
+
+    os.makedirs(local_dir, exist_ok=True)
+    local_tar = os.path.join(local_dir, "model.tar.gz")
+    s3_client.download_file(s3_bucket, s3_key, local_tar)
+    with tarfile.open(local_tar, "r:gz") as tar:
+        tar.extractall(local_dir)
+    found = _find_model_dir(local_dir)
+    if not found:
+        raise RuntimeError("Could not find extracted spaCy model folder")
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(source, f)
+    return found
+
+def prepare_models(model_map: Dict[str, Dict[str, str]], max_workers: int = 8) -> Dict[str, str]:
+    """{label: extracted model dir}; downloads run concurrently (I/O bound), current baked models skip the download."""
+    import boto3
+    s3_client = boto3.client("s3")  # clients are thread-safe; creating them is not
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(model_map)))) as pool:
+        futures = {label: pool.submit(download_and_extract_model, loc["bucket"], loc["key"], f".cache/{label}",
+                                      s3_client=s3_client)
+                   for label, loc in model_map.items()}
+    paths = {label: fut.result() for label, fut in futures.items()}
+    baked = {entry["path"] for entry in _baked_models().values()}
+    n_baked = sum(1 for path in paths.values() if path in baked)
+    print(f"[spancat] models ready ({n_baked} baked, {len(paths) - n_baked} from S3)")
+    startup_mark("models_ready")
+    return paths
 
 def load_models(model_map: Dict[str, Dict[str, str]]) -> List[Tuple[spacy.Language, str]]:
     """
@@ -158,8 +359,7 @@ def load_models(model_map: Dict[str, Dict[str, str]]) -> List[Tuple[spacy.Langua
     Returns list of (nlp, label)
     """
     pairs = []
-    for label, loc in model_map.items():
-        path = download_and_extract_model(loc["bucket"], loc["key"], local_dir=f".cache/{label}")
+    for label, path in prepare_models(model_map).items():
         nlp = spacy.load(path)
         pairs.append((nlp, label))
     return pairs
@@ -211,20 +411,10 @@ def process_table(df: pd.DataFrame,
 # ---------- recommend model helpers ----------
 
 def download_recommend_model(bucket: str, key: str, extract_dir: str = ".cache/recommend") -> str:
-    os.makedirs(extract_dir, exist_ok=True)
-    tar_path = os.path.join(extract_dir, "recommend.tar.gz")
-    boto3.client("s3").download_file(bucket, key, tar_path)
-    with tarfile.open(tar_path, "r:gz") as tar:
-        tar.extractall(extract_dir)
-    # expect model-last or model-best
-    for name in ["model-last", "model-best"]:
-        p = os.path.join(extract_dir, name)
-        if os.path.exists(p):
-            return p
-    for root, dirs, files in os.walk(extract_dir):
-        if "config.cfg" in files:
-            return root
-    raise RuntimeError("recommend textcat model not found in archive")
+    try:
+        return download_and_extract_model(bucket, key, extract_dir)
+    except RuntimeError:
+        raise RuntimeError("recommend textcat model not found in archive")
 
 def apply_filters_and_recommend(
     spans_df: pd.DataFrame,
@@ -236,6 +426,7 @@ def apply_filters_and_recommend(
     knn_obj=None,
     le_obj=None,
     emb_obj=None,
+    emb_cache: EmbeddingCache | None = None,
 ) -> pd.DataFrame:
     """
     - fix punctuation + emoji relevance
@@ -245,6 +436,12 @@ def apply_filters_and_recommend(
     if spans_df.empty:
         return spans_df
 
+    from run_filter_trust import (
+        time_fix_punctuation,
+        fix_same_subdomain_overlapping_spans,
+        fix_different_subdomain_overlapping_spans,
+    )
+
     # 1) punctuation & emoji relevance
     data = spans_df.to_dict(orient="records")
     data = time_fix_punctuation(data)  # updates in place (and sets relevant=0 for emoji)
@@ -270,6 +467,8 @@ def apply_filters_and_recommend(
     knn, le, emb = knn_obj, le_obj, emb_obj
     if (knn is None or le is None or emb is None) and knn_path and le_path:
         try:
+            import joblib
+            from sentence_transformers import SentenceTransformer
             knn = knn or joblib.load(knn_path)
             le  = le  or joblib.load(le_path)
             emb = emb or SentenceTransformer(embedding_model_name)
@@ -278,7 +477,8 @@ def apply_filters_and_recommend(
             knn, le, emb = None, None, None
 
     if knn and le and emb:
-        spans_by_comment = fix_different_subdomain_overlapping_spans(spans_by_comment, emb, knn, le)
+        spans_by_comment = fix_different_subdomain_overlapping_spans(spans_by_comment, emb, knn, le,
+                                                                     embedding_cache=emb_cache)
 
     # flatten back to df
     processed = [s for spans in spans_by_comment.values() for s in spans]
@@ -319,19 +519,164 @@ def apply_filters_and_recommend(
 
     return df
 
+# ---------- calibrate ----------
+
+def _int_list(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+def calibrate_main(argv: List[str]):
+    """
+    Sweep torch threads x n_process x batch size per model over a sample shard,
+    save the fastest in-budget setting per model as the profile for this hardware,
+    and write every measurement to a results table.
+    """
+    parser = argparse.ArgumentParser(prog="run_spancat_over_table.py calibrate")
+    parser.add_argument("--input", required=True, help="Sample shard CSV/Parquet (local or s3://)")
+    parser.add_argument("--text-col", default="cleaned_comment")
+    parser.add_argument("--models-json", required=True)
+    parser.add_argument("--labels", default="", help="Comma-separated subset of models to sweep (default: all)")
+    parser.add_argument("--sample-rows", type=int, default=1000,
+                        help="Rows timed per trial; enough batches that worker startup can be separated out")
+    parser.add_argument("--shard-rows", type=int, default=0,
+                        help="Rows of a production shard, to amortize worker startup over (default: rows in --input)")
+    parser.add_argument("--threads", default="", help="Comma list of torch threads (default: 1,cpus/2,cpus)")
+    parser.add_argument("--n-process", default="1,2", help="Comma list of spaCy n_process values")
+    parser.add_argument("--batch-sizes", default="16,32,64,128")
+    parser.add_argument("--memory-target", type=float, default=0.80,
+                        help="Reject settings whose sampled peak (scorer + workers) exceeds this fraction of the memory limit")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR_DEFAULT, help="Local dir or s3:// prefix")
+    parser.add_argument("--results-out", default="",
+                        help="Sweep results CSV/Parquet (default: <profile-dir>/<profile>_sweep.csv)")
+    args = parser.parse_args(argv)
+
+    hw = detect_hardware()
+    key = profile_key(hw)
+    budget = (read_memory_limit_bytes() or 0) * args.memory_target
+    cpus = hw["cpus"]
+    thread_grid = _int_list(args.threads) or sorted({1, max(1, cpus // 2), cpus})
+    nproc_grid = _int_list(args.n_process)
+    batch_grid = _int_list(args.batch_sizes)
+    print(f"[calibrate] profile={key} threads={thread_grid} n_process={nproc_grid} batch_sizes={batch_grid}")
+
+    with open(args.models_json, "r", encoding="utf-8") as f:
+        model_map = json.load(f)
+    if args.labels:
+        wanted = {l.strip() for l in args.labels.split(",")}
+        model_map = {k: v for k, v in model_map.items() if k in wanted}
+
+    df = read_table(args.input)
+    shard_rows = args.shard_rows or len(df)
+    texts = df.head(args.sample_rows)[args.text_col].fillna("").astype(str).tolist()
+    del df
+
+    results: List[Dict] = []
+    best: Dict[str, Dict] = {}
+    for label, loc in model_map.items():
+        model_dir = download_and_extract_model(loc["bucket"], loc["key"], f".cache/{label}")
+        nlp = spacy.load(model_dir)
+        try:
+            list(nlp.pipe(texts[:8]))  # warm-up, not timed
+            for threads in thread_grid:
+                set_torch_threads(threads)
+                for n_process in nproc_grid:
+                    if threads * n_process > cpus:
+                        continue
+                    for batch_size in batch_grid:
+                        gc.collect()
+                        error = ""
+                        t0 = time.perf_counter()
+                        t_first = None  # first batch out: spawning workers + loading their model copies
+                        # sampled while the trial runs: this process plus its n_process workers
+                        with PeakMemorySampler() as sampler:
+                            try:
+                                for i, _ in enumerate(nlp.pipe(texts, batch_size=batch_size, n_process=n_process)):
+                                    if i == batch_size - 1:
+                                        t_first = time.perf_counter()
+                            except MemoryError as e:
+                                error = f"MemoryError: {e}"
+                        t_end = time.perf_counter()
+                        secs = t_end - t0
+                        peak = sampler.peak
+                        # production starts the workers once per model and shard, not once per batch:
+                        # time the rows after the first batch separately and amortize startup over a shard
+                        steady_rows = len(texts) - batch_size
+                        if error or not secs:
+                            startup, steady = secs, 0.0
+                        elif t_first is None or steady_rows < batch_size or t_end <= t_first:
+                            startup, steady = 0.0, len(texts) / secs  # too few batches to separate
+                        else:
+                            startup, steady = t_first - t0, steady_rows / (t_end - t_first)
+                        projected = shard_rows / (startup + shard_rows / steady) if steady else 0.0
+                        row = {
+                            "profile": key, "cpus": cpus, "memory_gib": hw["memory_gib"], "model": label,
+                            "torch_threads": threads, "n_process": n_process, "batch_size": batch_size,
+                            "rows": len(texts), "seconds": round(secs, 3),
+                            "rows_per_sec": round(len(texts) / secs, 2) if secs > 0 and not error else 0.0,
+                            "startup_seconds": round(startup, 3),
+                            "steady_rows_per_sec": round(steady, 2),
+                            "shard_rows": shard_rows,
+                            "projected_rows_per_sec": round(projected, 2),
+                            "peak_rss_mib": round(peak / (1 << 20)),
+                            "within_budget": bool(not budget or peak <= budget),
+                            "error": error,
+                        }
+                        results.append(row)
+                        print(f"[calibrate] {label} threads={threads} n_process={n_process} "
+                              f"batch={batch_size} → {row['steady_rows_per_sec']} rows/s after "
+                              f"{row['startup_seconds']}s startup ({row['projected_rows_per_sec']} rows/s over "
+                              f"{shard_rows} rows), {row['peak_rss_mib']} MiB")
+        finally:
+            del nlp
+            gc.collect()
+
+        ok = [r for r in results if r["model"] == label and r["within_budget"] and not r["error"]]
+        if ok:
+            r = max(ok, key=lambda r: r["projected_rows_per_sec"])
+            best[label] = {"torch_threads": r["torch_threads"], "n_process": r["n_process"],
+                           "batch_size": r["batch_size"]}
+        else:
+            print(f"[warn] {label}: no setting fit the memory budget; leaving it on defaults")
+
+    # written even when nothing fits: comparing task sizes needs the too-small ones too
+    results_out = args.results_out or args.profile_dir.rstrip("/") + f"/{key}_sweep.csv"
+    write_table(pd.DataFrame(results), results_out)
+    print(f"[calibrate] wrote {len(results)} measurements → {results_out}")
+
+    if not best:
+        print("[calibrate] nothing to save.")
+        return
+    # default for models added later: the most common per-model winner
+    default = dict(Counter(tuple(sorted(b.items())) for b in best.values()).most_common(1)[0][0])
+    path = save_profile(args.profile_dir, hw, default, best)
+    print(f"[calibrate] saved profile → {path}")
+
 # ---------- main ----------
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "calibrate":
+        return calibrate_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser()
     # input/output (file OR prefix)
     g_io = parser.add_mutually_exclusive_group(required=True)
     g_io.add_argument("--input", help="Input CSV/Parquet file (local or s3://)")
     g_io.add_argument("--input-prefix", help="S3 or local prefix containing files")
+    g_io.add_argument("--redshift-sql-file",
+                      help="Like --redshift-sql, with the query read from a file (local or s3://)")
+    g_io.add_argument("--redshift-sql",
+                      help="Small-run fast path: run this query via the Redshift Data API and score the "
+                           "paged result in-process (no UNLOAD / S3 input)")
 
     g_out = parser.add_mutually_exclusive_group(required=True)
     g_out.add_argument("--output", help="Output CSV/Parquet file (local or s3://)")
     g_out.add_argument("--output-prefix", help="S3 or local prefix to write multiple parts")
 
+    parser.add_argument("--redshift-workgroup", default=os.environ.get("RS_WORKGROUP", ""))
+    parser.add_argument("--redshift-database", default=os.environ.get("RS_DATABASE", ""))
+    parser.add_argument("--redshift-secret-arn", default=os.environ.get("DB_SECRET_ARN", ""))
+    parser.add_argument("--redshift-local-source", default="",
+                        help="CSV/Parquet standing in for the Data API result (local runs)")
+
     parser.add_argument("--text-col", default="cleaned_comment")
     parser.add_argument("--exclusion-file", default="", help="Optional path to exclude_strings.txt")
     parser.add_argument("--thresholds-json", required=True,
@@ -345,12 +690,48 @@ def main():
     parser.add_argument("--knn-path", default="./models/knn_model.sav")
     parser.add_argument("--label-encoder-path", default="./models/label_encoder.sav")
     parser.add_argument("--embedding-model-name", default="paraphrase-MiniLM-L6-v2")
+    parser.add_argument("--embedding-cache-dir", default=".cache/embeddings",
+                        help="Persistent theme-text embedding store ('' to disable)")
+    parser.add_argument("--embedding-cache-s3", default="",
+                        help="Optional s3:// prefix the embedding store is pulled from / pushed to")
+    parser.add_argument("--embedding-cache-max-entries", type=int, default=200_000)
     parser.add_argument("--skip-recommend", action="store_true", help="Skip recommend textcat & KNN fixes")
     parser.add_argument("--load-mode", choices=["sequential","all"], default="sequential",
                         help="Load models one-by-one (low memory) or all at once.")
-    
-    args = parser.parse_args()
+    add_memory_args(parser)
+    parser.add_argument("--profile-dir", default=PROFILE_DIR_DEFAULT,
+                        help="Where `calibrate` saved hardware profiles (local dir or s3:// prefix)")
+    parser.add_argument("--no-profile", action="store_true", help="Ignore any calibration profile")
+
+    # sampling profiler (opt-in)
+    parser.add_argument("--sample-profile", action="store_true",
+                        help="Sample all thread stacks for the whole run; writes collapsed stacks + hotspots "
+                             "to <output>/_profile/")
+    parser.add_argument("--sample-profile-interval-ms", type=float, default=10.0)
+    parser.add_argument("--sample-profile-rows", type=int, default=0,
+                        help="With --sample-profile: profile only the first N rows; their output goes to "
+                             "<output>/_profile/partial/ and the shard is flagged partial")
+    parser.add_argument("--sample-profile-top", type=int, default=30)
 
+    args = parser.parse_args()
+    if args.sample_profile_rows and not args.sample_profile:
+        # the row budget skips the scored output, so it must never apply to a normal run
+        parser.error("--sample-profile-rows requires --sample-profile")
+
+    if not args.sample_profile:
+        return run(args)
+    profiler = SamplingProfiler(args.sample_profile_interval_ms / 1000.0).start()
+    try:
+        run(args)
+    finally:
+        profiler.stop()
+        out_dir = profile_dir_for(args.output or args.output_prefix)
+        write_text(profiler.collapsed(), f"{out_dir}/profile.collapsed")
+        write_text(profiler.summary(args.sample_profile_top), f"{out_dir}/hotspots.txt")
+        print(f"[profile] {sum(profiler.samples.values())} samples → {out_dir}/")
+        print(profiler.summary(10))
+
+def run(args):
     exclusion = load_exclusion_list(args.exclusion_file)
 
     with open(args.thresholds_json, "r", encoding="utf-8") as f:
@@ -360,7 +741,9 @@ def main():
 
     # Determine inputs
     inputs: List[str]
-    if args.input:
+    if args.redshift_sql or args.redshift_sql_file:
+        inputs = [REDSHIFT_INPUT]
+    elif args.input:
         if _is_prefix(args.input):
             raise ValueError("--input looks like a prefix. Use --input-prefix instead.")
         inputs = [args.input]
@@ -395,21 +778,57 @@ def main():
     if not args.skip_recommend:
         try:
             if os.path.exists(args.knn_path) and os.path.exists(args.label_encoder_path):
+                import joblib
+                from sentence_transformers import SentenceTransformer
                 knn_obj = joblib.load(args.knn_path)
                 le_obj  = joblib.load(args.label_encoder_path)
                 emb_obj = SentenceTransformer(args.embedding_model_name)
         except Exception as e:
             print(f"[warn] Could not preload KNN/LE/emb: {e}")
 
+    # only the KNN subdomain fix encodes theme texts: without its models, don't open (or pull) the cache
+    emb_cache = None
+    if knn_obj is not None and le_obj is not None and emb_obj is not None and args.embedding_cache_dir:
+        try:
+            emb_cache = EmbeddingCache(args.embedding_cache_dir, args.embedding_model_name,
+                                       max_entries=args.embedding_cache_max_entries,
+                                       s3_prefix=args.embedding_cache_s3 or None)
+        except Exception as e:
+            print(f"[warn] Could not open embedding cache: {e}")
+
+    profile = None
+    if not args.no_profile:
+        profile = load_profile(args.profile_dir)
+        if profile:
+            print(f"[spancat] using calibration profile {profile_key(profile['hardware'])} "
+                  f"(default={profile.get('default')})")
+            set_torch_threads((profile.get("default") or {}).get("torch_threads"))
+
+    # one controller across files so batch size / footprint estimates carry over
+    controller = AdaptiveBatchController.from_args(args)
+
+    # --sample-profile-rows: row budget across all inputs
+    rows_left = args.sample_profile_rows or None
+    partial_files: List[str] = []
+
     # Process each input file
     for idx, in_path in enumerate(inputs, start=1):
-        df_in = read_table(in_path)
+        if rows_left == 0:
+            break
+        df_in = read_redshift(args) if in_path == REDSHIFT_INPUT else read_table(in_path)
+        if rows_left is not None:
+            df_in = df_in.head(rows_left)
+            rows_left -= len(df_in)
+        if df_in.empty:
+            print(f"[spancat] {in_path}: no rows, skipping")
+            continue
 
         if args.load_mode == "all":
             models = load_models(model_map)
             scored = process_table(df_in, args.text_col, models, thresholds, exclusion)
         else:
-            scored = process_table_sequential(df_in, args.text_col, model_map, thresholds, exclusion)
+            scored = process_table_sequential(df_in, args.text_col, model_map, thresholds, exclusion,
+                                              controller=controller, profile=profile)
 
         if not scored.empty:
             scored = apply_filters_and_recommend(
@@ -419,6 +838,7 @@ def main():
                 le_path=(None if args.skip_recommend else args.label_encoder_path),
                 embedding_model_name=args.embedding_model_name,
                 knn_obj=knn_obj, le_obj=le_obj, emb_obj=emb_obj,   # reuse once-loaded objects
+                emb_cache=emb_cache,
             )
 
         # figure output target
@@ -434,9 +854,28 @@ def main():
             prefix = args.output_prefix.rstrip("/")
             out_path = f"{prefix}/part_{idx:05d}.parquet"
 
+        if args.sample_profile_rows:
+            # partial shard – written under _profile/ (which compaction skips), never as real output
+            out_path = profile_dir_for(args.output or args.output_prefix) + f"/partial/part_{idx:05d}.parquet"
+            partial_files.append(out_path)
         write_table(scored, out_path)
         print(f"[spancat] wrote {len(scored)} rows → {out_path}")
+        startup_mark("first_output_written")
+
+    if args.sample_profile_rows:
+        # marker compaction records in the manifest (and Notify in the message): this shard is incomplete
+        marker = profile_dir_for(args.output or args.output_prefix) + "/PARTIAL.json"
+        write_text(json.dumps({"sample_profile_rows": args.sample_profile_rows, "files": partial_files}), marker)
+        print(f"[spancat] profiled {args.sample_profile_rows} rows only: partial output flagged in {marker}")
+
+    if emb_cache is not None:
+        print(f"[embcache] hits={emb_cache.hits} misses={emb_cache.misses} size={len(emb_cache)}")
+        try:
+            emb_cache.push()
+        except Exception as e:
+            print(f"[warn] Could not save embedding cache: {e}")
 
+    print(f"[startup] {json.dumps(_startup)}")
     print("[spancat] DONE.")
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+"""
+In-process sampling profiler for scoring shards.
+
+A daemon thread snapshots every thread's Python stack (sys._current_frames) every
+`interval` seconds, so it also sees s3fs/fsspec I/O threads, and aggregates them into
+collapsed stacks ("thread;outer;...;inner count"), which flamegraph.pl, speedscope and
+inferno read as-is. No ptrace / extra packages needed, so it works on Fargate.
+
+Caveats: time spent in C code that holds the GIL is attributed to the Python caller
+once the GIL is released; worker processes started by nlp.pipe(n_process>1) are not sampled.
+"""
+import os, sys, time, threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.ticks = 0
+        self.busy_seconds = 0.0
+        self.wall_seconds = 0.0
+        self._labels: Dict[object, str] = {}
+        self._names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._t0 = 0.0
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            parts = code.co_filename.replace("\\", "/").split("/")
+            label = f"{code.co_name} ({'/'.join(parts[-2:])}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            t = time.perf_counter()
+            if self.ticks % 100 == 0:
+                self._names = {th.ident: th.name for th in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(self._names.get(tid, f"thread-{tid}"))
+                self.samples[tuple(reversed(stack))] += 1
+            self.ticks += 1
+            self.busy_seconds += time.perf_counter() - t
+
+    def start(self) -> "SamplingProfiler":
+        self._t0 = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.wall_seconds = time.perf_counter() - self._t0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------- reports ----------
+
+    def collapsed(self) -> str:
+        """Brendan Gregg collapsed-stack format, one stack per line."""
+        return "".join(f"{';'.join(s)} {n}\n" for s, n in self.samples.most_common())
+
+    def hotspots(self, top: int = 30, thread: str = "MainThread") -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """
+        (self-time, inclusive-time) top-N frames by sample count for one thread. Blocking
+        s3fs calls show up here as fsspec sync() waits; idle helper threads would only dilute it.
+        """
+        own: Counter = Counter()
+        incl: Counter = Counter()
+        for stack, n in self.samples.items():
+            frames = stack[1:]  # drop thread name
+            if stack[0] != thread or not frames:
+                continue
+            own[frames[-1]] += n
+            for f in set(frames):
+                incl[f] += n
+        return own.most_common(top), incl.most_common(top)
+
+    def summary(self, top: int = 30, thread: str = "MainThread") -> str:
+        per_thread: Counter = Counter()
+        for stack, n in self.samples.items():
+            per_thread[stack[0]] += n
+        total = per_thread.get(thread) or 1
+        own, incl = self.hotspots(top, thread)
+        overhead = self.busy_seconds / self.wall_seconds if self.wall_seconds else 0.0
+        lines = [
+            f"wall={self.wall_seconds:.1f}s ticks={self.ticks} interval={self.interval * 1000:.0f}ms "
+            f"sampler_overhead={overhead:.1%}",
+            "samples per thread: " + ", ".join(f"{t}={n}" for t, n in per_thread.most_common()),
+            "",
+            f"{thread} – top {top} by self samples:",
+        ]
+        lines += [f"  {n:>8}  {n / total:6.1%}  {f}" for f, n in own]
+        lines += ["", f"{thread} – top {top} by inclusive samples:"]
+        lines += [f"  {n:>8}  {n / total:6.1%}  {f}" for f, n in incl]
+        return "\n".join(lines) + "\n"
+
+
+def profile_dir_for(output: str) -> str:
+    """Where profile artefacts go: <output-prefix>/_profile/ or next to an output file."""
+    if output.endswith("/") or not os.path.splitext(output)[1]:
+        return output.rstrip("/") + "/_profile"
+    return output.rsplit("/", 1)[0] + "/_profile" if "/" in output else "_profile"
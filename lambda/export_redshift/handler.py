@@ -1,4 +1,4 @@
-import os, json, uuid, time, datetime
+import os, re, json, uuid, time, datetime
 from zoneinfo import ZoneInfo
 import boto3
 
@@ -7,6 +7,57 @@ ssm = boto3.client("ssm")
 def _get_param(name: str) -> str:
     return ssm.get_parameter(Name=name, WithDecryption=True)["Parameter"]["Value"]
 
+# a quoted literal/identifier (kept) or a -- comment (dropped); '' and "" are escaped quotes
+_LITERAL_OR_COMMENT = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|--[^\n]*")
+
+def _strip_statement(sql: str) -> str:
+    # drop -- comments (not "--" inside quotes, e.g. LIKE '%--%') and the trailing ';'
+    # so the query can be wrapped in a sub-select
+    sql = _LITERAL_OR_COMMENT.sub(lambda m: m.group(1) or "", sql)
+    return sql.strip().rstrip(";").strip()
+
+def _wait(rs, sid: str) -> dict:
+    delay = 1.0
+    while True:
+        d = rs.describe_statement(Id=sid)
+        s = d["Status"]
+        if s in ("FINISHED","FAILED","ABORTED"):
+            if s != "FINISHED":
+                raise RuntimeError(json.dumps(d, default=str))
+            return d
+        time.sleep(delay)
+        delay = min(delay * 1.5, 10.0)
+
+def _up_ids(event) -> list:
+    # batch mode: "up_ids": [7168, 1234] (or "7168,1234"); otherwise the single up_id
+    raw = event.get("up_ids")
+    if raw is None:
+        raw = [event.get("up_id") or os.environ.get("DEFAULT_UP_ID", "7168")]
+    elif isinstance(raw, str):
+        raw = [x for x in raw.split(",") if x.strip()]
+    up_ids = sorted({int(str(x).strip()) for x in raw})  # validate numeric; raises if bad
+    if not up_ids or any(u <= 0 for u in up_ids):
+        raise ValueError("up_id(s) must be positive integers")
+    return up_ids
+
+def tenant_run_id(run_id: str, up_id: int, batch: bool) -> str:
+    # per-tenant outputs keep the usual run_id=<...>/ layout; batch tenants get <run_id>-up<up_id>
+    return f"{run_id}-up{up_id}" if batch else run_id
+
+def _count_sql(sql: str, limit: int) -> str:
+    # counts at most `limit` rows: enough to decide direct vs UNLOAD
+    return (f"SELECT COUNT(*) FROM (SELECT 1 FROM (\n{_strip_statement(sql)}\n) AS q "
+            f"LIMIT {int(limit)}) AS c")
+
+def _tagged_sql(sql_template: str, up_ids: list, run_date: str) -> str:
+    # one statement for every tenant: the per-tenant query tagged with its up_id, UNION ALL'd,
+    # so per-tenant limits in the template still apply per tenant
+    parts = []
+    for up_id in up_ids:
+        sql = sql_template.replace(":run_date", f"DATE '{run_date}'").replace("{UP_ID}", str(up_id))
+        parts.append(f"SELECT CAST({up_id} AS BIGINT) AS up_id, q.* FROM (\n{_strip_statement(sql)}\n) AS q")
+    return "\nUNION ALL\n".join(parts)
+
 def handler(event, _ctx):
 
     # build region-specific redshift-data client
@@ -19,11 +70,11 @@ def handler(event, _ctx):
     run_id = event.get("run_id") or str(uuid.uuid4())
     run_date = event.get("run_date") or datetime.datetime.now(ZoneInfo("Europe/London")).date().isoformat()
     
-    #up_id (default allowed; also allow env default)
-    up_id = event.get("up_id") or os.environ.get("DEFAULT_UP_ID", "7168")
-    up_id = int(str(up_id))  # validate numeric; raises if bad
-    if up_id <= 0:
-        raise ValueError("up_id must be a positive integer")
+    #up_id(s) (default allowed; also allow env default)
+    up_ids = _up_ids(event)
+    batch = "up_ids" in event
+    tenants = [{"up_id": u, "run_id": tenant_run_id(run_id, u, batch)} for u in up_ids]
+    up_id = up_ids[0] if not batch else None
 
     data_bucket     = _get_param(os.environ["PARAM_DATA_BUCKET"])
     sql_template    = _get_param(os.environ["PARAM_SQL"])
@@ -40,9 +91,47 @@ def handler(event, _ctx):
 
     prefix = f"s3://{data_bucket}/trust_scoring/raw/run_date={run_date}/run_id={run_id}/batch_"
 
-    #inject as DATE literal
-    sql_inner = sql_template.replace(":run_date", f"DATE '{run_date}'")
-    sql_inner = sql_template.replace("{UP_ID}", str(up_id))
+    #inject as DATE literal, one tagged block per up_id
+    sql_inner = _tagged_sql(sql_template, up_ids, run_date)
+
+    # run inputs that grow with the tenant count go to S3 and are passed by reference:
+    # ECS container overrides cap at 8 KiB (compaction reads the tenant list from here)
+    s3 = boto3.client("s3")
+    queries_key = f"trust_scoring/queries/run_id={run_id}"
+    s3.put_object(Bucket=data_bucket, Key=f"{queries_key}/tenants.json", Body=json.dumps(tenants).encode("utf-8"))
+    tenants_uri = f"s3://{data_bucket}/{queries_key}/tenants.json"
+
+    # small runs skip UNLOAD → S3 → Map: the scorer reads the result through the Data API
+    # an explicit 0 in the execution input means "always UNLOAD", so only a missing key falls back to env
+    fast_path_max_rows = event.get("fast_path_max_rows")
+    if fast_path_max_rows is None:
+        fast_path_max_rows = os.environ.get("FAST_PATH_MAX_ROWS", "0")
+    fast_path_max_rows = int(fast_path_max_rows)
+    if fast_path_max_rows > 0:
+        # the LIMIT only saves work for queries Redshift can stop early; a window/ORDER BY over the
+        # whole result (trust_source.sql's ROW_NUMBER) still runs in full
+        count_id = rs.execute_statement(WorkgroupName=workgroup, Database=database, SecretArn=secret_arn,
+                                        Sql=_count_sql(sql_inner, fast_path_max_rows + 1))["Id"]
+        _wait(rs, count_id)
+        row_count = rs.get_statement_result(Id=count_id)["Records"][0][0]["longValue"]
+        if row_count <= fast_path_max_rows:
+            sql_key = f"{queries_key}/query.sql"
+            s3.put_object(Bucket=data_bucket, Key=sql_key, Body=_strip_statement(sql_inner).encode("utf-8"))
+            return {
+                "mode": "direct",
+                "run_id": run_id,
+                "run_date": run_date,
+                "up_id": up_id,
+                "up_ids": up_ids,
+                "tenants": tenants,
+                "tenants_uri": tenants_uri,
+                "row_count": row_count,
+                "sql_uri": f"s3://{data_bucket}/{sql_key}",
+                "workgroup": workgroup,
+                "database": database,
+                "secret_arn": secret_arn,
+                "s3_prefix": "",
+            }
 
     unload = f"""
     UNLOAD ($${sql_inner}$$)
@@ -67,20 +156,15 @@ def handler(event, _ctx):
     resp = rs.execute_statement(**args)
     sid = resp["Id"]
 
-    delay = 1.0
-    while True:
-        d = rs.describe_statement(Id=sid)
-        s = d["Status"]
-        if s in ("FINISHED","FAILED","ABORTED"):
-            if s != "FINISHED":
-                raise RuntimeError(json.dumps(d, default=str))
-            break
-        time.sleep(delay)
-        delay = min(delay * 1.5, 10.0)
+    _wait(rs, sid)
 
     return {
+        "mode": "unload",
         "run_id": run_id,
         "run_date": run_date,
         "up_id": up_id,
+        "up_ids": up_ids,
+        "tenants": tenants,
+        "tenants_uri": tenants_uri,
         "s3_prefix": prefix.rsplit("/",1)[0] + "/"
     }
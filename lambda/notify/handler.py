@@ -2,12 +2,30 @@ import os, json, boto3
 
 ssm = boto3.client("ssm")
 sns = boto3.client("sns")
+s3 = boto3.client("s3")
 
 def _get_param(name: str) -> str:
     return ssm.get_parameter(Name=name, WithDecryption=True)["Parameter"]["Value"]
 
+def _partial_shards(bucket: str, compacted_key: str) -> list:
+    # shards scored with SAMPLE_PROFILE_ROWS (row sample only), as recorded by compaction
+    try:
+        body = s3.get_object(Bucket=bucket, Key=f"{compacted_key}manifest.json")["Body"].read()
+        return json.loads(body).get("partial_shards") or []
+    except Exception:
+        return []
+
 def _first_existing(d: dict, paths):
-    ...
+    # first non-empty value found along any of the key paths
+    for path in paths:
+        cur = d
+        for k in path:
+            if not isinstance(cur, dict) or k not in cur:
+                cur = None
+                break
+            cur = cur[k]
+        if cur:
+            return cur
     return None
 
 def handler(event, _ctx):
@@ -24,15 +42,16 @@ def handler(event, _ctx):
 
     run_id   = export_payload["run_id"]
     run_date = export_payload["run_date"]
-    up_id = export_payload["up_id"]
-    raw_prefix = export_payload["s3_prefix"]
+    # batch runs carry one {"up_id", "run_id"} per tenant; older payloads a single up_id
+    tenants = export_payload.get("tenants") or [{"up_id": export_payload["up_id"], "run_id": run_id}]
+    # direct (small-run) exports stream from Redshift and have no raw prefix
+    raw_prefix = export_payload.get("s3_prefix") or None
 
     # pick up an optional email from the execution input
     notify_email = _first_existing(event, [["email"], ["Email"]])
 
     topic_arn   = _get_param(os.environ["PARAM_SNS_TOPIC"])
     data_bucket = _get_param(os.environ["PARAM_DATA_BUCKET"])
-    scored_prefix = f"s3://{data_bucket}/trust_scoring/scored/run_id={run_id}/"
 
     # ecs details
     exit_code = None
@@ -47,29 +66,47 @@ def handler(event, _ctx):
     except Exception:
         pass
 
-    subject = f"Trust scoring complete — run_id={run_id}"
-    message = {
-        "run_id": run_id,
-        "run_date": run_date,
-        "up_id": up_id,
-        "raw_prefix": raw_prefix,
-        "scored_prefix": scored_prefix,
-    }
-    if notify_email:
-        message["notify_email"] = notify_email  #include in email body
-    if exit_code is not None:
-        message["ecs_exit_code"] = exit_code
-    if stopped_reason:
-        message["ecs_stopped_reason"] = stopped_reason
+    # one notification per tenant, pointing at that tenant's own scored / compacted run prefixes
+    messages = []
+    for tenant in tenants:
+        tenant_run_id = tenant["run_id"]
+        scored_prefix = f"s3://{data_bucket}/trust_scoring/scored/run_id={tenant_run_id}/"
+        compacted_key = f"trust_scoring/compacted/run_id={tenant_run_id}/"
+        partial_shards = _partial_shards(data_bucket, compacted_key)
+        subject = (f"Trust scoring PARTIAL (profiling sample) — run_id={tenant_run_id}" if partial_shards
+                   else f"Trust scoring complete — run_id={tenant_run_id}")
+        message = {
+            "run_id": tenant_run_id,
+            "run_date": run_date,
+            "up_id": tenant["up_id"],
+            "export_mode": export_payload.get("mode", "unload"),
+            "raw_prefix": raw_prefix,
+            "scored_prefix": scored_prefix,
+            "compacted_prefix": f"s3://{data_bucket}/{compacted_key}",
+        }
+        if partial_shards:
+            message["partial_shards"] = partial_shards
+        if tenant_run_id != run_id:
+            # compaction split the batch's scored shards into the tenant's prefix; the batch one keeps all
+            message["batch_run_id"] = run_id
+            message["batch_scored_prefix"] = f"s3://{data_bucket}/trust_scoring/scored/run_id={run_id}/"
+            message["batch_up_ids"] = [t["up_id"] for t in tenants]
+        if notify_email:
+            message["notify_email"] = notify_email  #include in email body
+        if exit_code is not None:
+            message["ecs_exit_code"] = exit_code
+        if stopped_reason:
+            message["ecs_stopped_reason"] = stopped_reason
 
-    sns.publish(
-        TopicArn=topic_arn,
-        Subject=subject,
-        Message=json.dumps(message, indent=2),
-        MessageAttributes=(
-            {"notify_email": {"DataType": "String", "StringValue": notify_email}}
-            if notify_email else {}
-        ),
-    )
+        sns.publish(
+            TopicArn=topic_arn,
+            Subject=subject,
+            Message=json.dumps(message, indent=2),
+            MessageAttributes=(
+                {"notify_email": {"DataType": "String", "StringValue": notify_email}}
+                if notify_email else {}
+            ),
+        )
+        messages.append(message)
 
-    return {"ok": True, "notified_topic": topic_arn, "message": message}
\ No newline at end of file
+    return {"ok": True, "notified_topic": topic_arn, "messages": messages}
@@ -164,6 +164,8 @@ export class TrustPipelineStack extends Stack {
         AWS_DEFAULT_REGION: Stack.of(this).region,
         // loc to download the trained models from S3
         MODELS_S3_PREFIX: 's3://aws-emr-studio-977903982786-us-east-1/ECU-trust-subdomains/',
+        // theme-text embeddings shared across shards and runs (deltas folded in by CompactScored)
+        EMBEDDING_CACHE_S3: `s3://${dataBucket.bucketName}/trust_scoring/embedding_cache/`,
       },
     });
 
@@ -189,6 +191,8 @@ export class TrustPipelineStack extends Stack {
         PARAM_RS_DATABASE: pDatabase.parameterName,
         RS_REGION: Stack.of(this).region,
         DB_SECRET_ARN: dbSecret.secretArn,
+        // runs at or under this many rows skip UNLOAD/Map and stream to one scorer (0 = always UNLOAD)
+        FAST_PATH_MAX_ROWS: '20000',
       },
     });
 
@@ -203,10 +207,21 @@ export class TrustPipelineStack extends Stack {
     }));
 
     // Permissions for Redshift Data API & SSM
-    exportFn.addToRolePolicy(new iam.PolicyStatement({
-      actions: ['redshift-data:ExecuteStatement','redshift-data:DescribeStatement','redshift-data:GetStatementResult'],
-      resources: ['*'] //TO DO tighten - scope to workgroup/database
-    }));
+    // ExecuteStatement is scoped to the account's serverless workgroups; Describe/GetStatementResult
+    // have no resource type, so they are limited to statements the caller ran itself
+    const rsWorkgroupArn = `arn:aws:redshift-serverless:${Stack.of(this).region}:${Stack.of(this).account}:workgroup/*`;
+    const rsDataStatements = () => [
+      new iam.PolicyStatement({
+        actions: ['redshift-data:ExecuteStatement'],
+        resources: [rsWorkgroupArn],
+      }),
+      new iam.PolicyStatement({
+        actions: ['redshift-data:DescribeStatement','redshift-data:GetStatementResult'],
+        resources: ['*'],
+        conditions: { StringEquals: { 'redshift-data:statement-owner-iam-userid': '${aws:userid}' } },
+      }),
+    ];
+    rsDataStatements().forEach(st => exportFn.addToRolePolicy(st));
     exportFn.addToRolePolicy(new iam.PolicyStatement({
       actions: ['ssm:GetParameter','ssm:GetParameters'],
       resources: [pSql.parameterArn, pDataBucket.parameterArn, pUnloadRole.parameterArn, pWorkgroup.parameterArn, pDatabase.parameterArn, pRsRegion.parameterArn]
@@ -216,7 +231,7 @@ export class TrustPipelineStack extends Stack {
       actions: ['redshift-serverless:GetCredentials'],
       resources: [
         // All workgroups in this account/region (tighten to a specific workgroup ARN later if you like)
-        `arn:aws:redshift-serverless:${Stack.of(this).region}:${Stack.of(this).account}:workgroup/*`,
+        rsWorkgroupArn,
       ],
     }));
 
@@ -229,6 +244,18 @@ export class TrustPipelineStack extends Stack {
 
     dataBucket.grantReadWrite(exportFn); // for list/verify
 
+    // Direct (small-run) path: the scorer runs the query itself – the Data API only returns
+    // results to the identity that ran the statement
+    rsDataStatements().forEach(st => taskRole.addToPolicy(st));
+    taskRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['secretsmanager:DescribeSecret', 'secretsmanager:GetSecretValue'],
+      resources: [secretArnNoSuffix, secretArnWithSuffix],
+    }));
+    taskRole.addToPolicy(new iam.PolicyStatement({
+      actions: ['redshift-serverless:GetCredentials'],
+      resources: [rsWorkgroupArn],
+    }));
+
     // ---- Notify Lambda ----
     const notifyFn = new lambda.Function(this, 'NotifyFn', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -244,6 +271,8 @@ export class TrustPipelineStack extends Stack {
       actions: ['ssm:GetParameter'], resources: [pTopicArn.parameterArn, pDataBucket.parameterArn]
     }));
     topic.grantPublish(notifyFn);
+    // compaction manifests: flag runs with profiling-only (partial) shards
+    dataBucket.grantRead(notifyFn, 'trust_scoring/compacted/*');
    
     // ------ list inputs lambda ------
     const listInputsFn = new lambda.Function(this, 'ListInputsFn', {
@@ -308,6 +337,8 @@ export class TrustPipelineStack extends Stack {
     const map = new sfn.Map(this, 'RunBatches', {
       itemsPath: sfn.JsonPath.stringAt('$.Plan.Payload.keys'),
       maxConcurrency: 6,   // start with 6, adjust later
+      // keep the state (Export payload) for CompactScored / Notify instead of the iteration results
+      resultPath: sfn.JsonPath.DISCARD,
     });
 
     // One ECS task per file
@@ -341,6 +372,70 @@ export class TrustPipelineStack extends Stack {
     // plug iterator
     map.itemProcessor(runOne);
 
+    // Compact: merge all shard outputs into posted_date/theme partitions sorted by comment_unique_key,
+    // one compacted run prefix per up_id
+    const compactTask = new tasks.EcsRunTask(this, 'CompactScored', {
+      cluster,
+      taskDefinition: taskDef,
+      launchTarget: new tasks.EcsFargateLaunchTarget(),
+      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
+      assignPublicIp: true,
+      taskTimeout: sfn.Timeout.duration(Duration.hours(1)),
+      containerOverrides: [{
+        containerDefinition: container,
+        environment: [
+          { name: 'SPANCAT_MODE', value: 'compact' },
+          { name: 'RUN_ID', value: sfn.JsonPath.stringAt('$.Export.Payload.run_id') },
+          // split by up_id: each tenant lands in compacted/run_id=<tenant run_id>/; the tenant list is
+          // read from S3 – inline JSON would outgrow the 8 KiB override limit at ~130 up_ids
+          { name: 'COMPACT_TENANTS_URI', value: sfn.JsonPath.stringAt('$.Export.Payload.tenants_uri') },
+          {
+            name: 'INPUT_PREFIX',
+            value: sfn.JsonPath.format(
+              's3://{}/trust_scoring/scored/run_id={}/',
+              dataBucket.bucketName,
+              sfn.JsonPath.stringAt('$.Export.Payload.run_id'),
+            ),
+          },
+          {
+            name: 'OUTPUT_PREFIX',
+            value: `s3://${dataBucket.bucketName}/trust_scoring/compacted/`,
+          },
+        ],
+      }],
+      resultPath: sfn.JsonPath.DISCARD,
+    });
+
+    // Small runs: one task pages the query result straight from the Data API and scores it
+    const runDirect = new tasks.EcsRunTask(this, 'RunDirect', {
+      cluster,
+      taskDefinition: taskDef,
+      launchTarget: new tasks.EcsFargateLaunchTarget(),
+      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
+      assignPublicIp: true,
+      taskTimeout: sfn.Timeout.duration(Duration.hours(2)),
+      containerOverrides: [{
+        containerDefinition: container,
+        environment: [
+          { name: 'SPANCAT_MODE', value: 'direct' },
+          // the query itself is in S3: batch SQL outgrows the 8 KiB container-override limit
+          { name: 'REDSHIFT_SQL_URI', value: sfn.JsonPath.stringAt('$.Export.Payload.sql_uri') },
+          { name: 'RS_WORKGROUP', value: sfn.JsonPath.stringAt('$.Export.Payload.workgroup') },
+          { name: 'RS_DATABASE', value: sfn.JsonPath.stringAt('$.Export.Payload.database') },
+          { name: 'DB_SECRET_ARN', value: sfn.JsonPath.stringAt('$.Export.Payload.secret_arn') },
+          {
+            name: 'OUTPUT_PREFIX',
+            value: sfn.JsonPath.format(
+              's3://{}/trust_scoring/scored/run_id={}/shard=0/',
+              dataBucket.bucketName,
+              sfn.JsonPath.stringAt('$.Export.Payload.run_id'),
+            ),
+          },
+        ],
+      }],
+      resultPath: '$.Ecs',
+    });
+
     // Run task: (see above) resultPath: '$.Ecs'
 
     // Notify: pass explicitly
@@ -352,10 +447,12 @@ export class TrustPipelineStack extends Stack {
     });
 
     //const definition = exportTask.next(runTask).next(notifyTask);
-    const definition = exportTask
-      .next(plan)
-      .next(map)
-      .next(notifyTask);
+    compactTask.next(notifyTask);
+    const definition = exportTask.next(
+      new sfn.Choice(this, 'ExportMode')
+        .when(sfn.Condition.stringEquals('$.Export.Payload.mode', 'direct'), runDirect.next(compactTask))
+        .otherwise(plan.next(map).next(compactTask))
+    );
 
     // IMPORTANT: raise overall timeout
     const sm = new sfn.StateMachine(this, 'TrustScoringSm', {
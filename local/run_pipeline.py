@@ -0,0 +1,346 @@
+"""
+Local stand-in for the TrustScoringSm state machine:
+Export → PlanInputs → RunBatches (Map) → CompactScored → Notify.
+
+Calls the real Lambda handlers from lambda/ and runs run_spancat_over_table.py once per shard
+on a local process pool (no maxConcurrency=6 / Fargate limit). Two backends:
+
+  local – S3 is a directory tree (s3://bucket/key → <root>/bucket/key), Redshift UNLOAD
+          copies a source CSV/Parquet into the export prefix (small runs under
+          --fast-path-max-rows page it through get_statement_result instead), SSM/Secrets are in-memory,
+          SNS writes to <root>/notifications.jsonl
+  aws   – handlers and scorer talk to the real services (backfills on one big box)
+
+Usage:
+  python local/run_pipeline.py --source sample.parquet --run-id dev-001
+  python local/run_pipeline.py --backend aws --up-id 7168 --run-id backfill-7168 --workers 12
+  python local/run_pipeline.py --source sample.parquet --up-ids 7168,1234 --run-id dev-batch
+"""
+import os, io, sys, json, time, uuid, queue, argparse, importlib.util, subprocess, contextlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import boto3
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPANCAT_DIR = os.path.join(REPO, "docker", "spancat")
+sys.path.insert(0, SPANCAT_DIR)
+from hardware_profile import detect_hardware  # noqa: E402
+from redshift_source import FileRedshiftData  # noqa: E402
+
+# same parameter names the stack creates
+PARAMS = {
+    "PARAM_SQL": "/trust_scoring/sql",
+    "PARAM_DATA_BUCKET": "/trust_scoring/data_bucket",
+    "PARAM_UNLOAD_ROLE": "/trust_scoring/redshift/unload_role_arn",
+    "PARAM_RS_WORKGROUP": "/trust_scoring/redshift/workgroup",
+    "PARAM_RS_DATABASE": "/trust_scoring/redshift/database",
+    "PARAM_SNS_TOPIC": "/trust_scoring/notify_topic_arn",
+}
+
+# ---------- local backend ----------
+
+class LocalStore:
+    """Maps s3://bucket/key onto <root>/bucket/key."""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def to_local(self, uri: str) -> str:
+        if not uri.startswith("s3://"):
+            return uri
+        local = os.path.join(self.root, uri[len("s3://"):])
+        return local + os.sep if uri.endswith("/") else local
+
+
+class LocalS3:
+    def __init__(self, store: LocalStore):
+        self.store = store
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", **_):
+        path = self.store.to_local(f"s3://{Bucket}/{Key}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(Body.encode("utf-8") if isinstance(Body, str) else Body)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, **_):
+        with open(self.store.to_local(f"s3://{Bucket}/{Key}"), "rb") as f:
+            return {"Body": io.BytesIO(f.read())}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", ContinuationToken: Optional[str] = None, **_):
+        base = os.path.join(self.store.root, Bucket)
+        keys = []
+        for dirpath, _dirs, files in os.walk(base):
+            for name in files:
+                key = os.path.relpath(os.path.join(dirpath, name), base).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    keys.append(key)
+        return {"Contents": [{"Key": k} for k in sorted(keys)], "IsTruncated": False}
+
+
+class LocalSsm:
+    def __init__(self, values: Dict[str, str]):
+        self.values = values
+
+    def get_parameter(self, Name: str, **_):
+        return {"Parameter": {"Name": Name, "Value": self.values[Name]}}
+
+
+class LocalSecrets:
+    def get_secret_value(self, SecretId: str, **_):
+        return {"ARN": f"arn:local:secretsmanager:::secret:{SecretId}", "SecretString": "{}"}
+
+
+class LocalSns:
+    def __init__(self, outbox: str):
+        self.outbox = outbox
+
+    def publish(self, **kwargs):
+        with open(self.outbox, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"at": datetime.now().isoformat(timespec="seconds"), **kwargs}, default=str) + "\n")
+        print(f"[local] SNS → {self.outbox}: {kwargs.get('Subject')}")
+        return {"MessageId": str(uuid.uuid4())}
+
+
+class LocalBackend:
+    name = "local"
+
+    def __init__(self, root: str, source: str, data_bucket: str, slices: int):
+        self.store = LocalStore(root)
+        self.source = os.path.abspath(source)
+        os.makedirs(self.store.root, exist_ok=True)
+        with open(os.path.join(REPO, "sql", "trust_source.sql"), "r", encoding="utf-8") as f:
+            sql = f.read()
+        ssm = LocalSsm({
+            PARAMS["PARAM_SQL"]: sql,
+            PARAMS["PARAM_DATA_BUCKET"]: data_bucket,
+            PARAMS["PARAM_UNLOAD_ROLE"]: "arn:local:iam::role/unload",
+            PARAMS["PARAM_RS_WORKGROUP"]: "local",
+            PARAMS["PARAM_RS_DATABASE"]: "local",
+            PARAMS["PARAM_SNS_TOPIC"]: "arn:local:sns:::trust-notify",
+        })
+        self._clients = {
+            "ssm": ssm,
+            "secretsmanager": LocalSecrets(),
+            "redshift-data": FileRedshiftData(self.source, to_local=self.store.to_local, slices=slices),
+            "s3": LocalS3(self.store),
+            "sns": LocalSns(os.path.join(self.store.root, "notifications.jsonl")),
+        }
+
+    def client(self, service_name: str, *_args, **_kwargs):
+        return self._clients[service_name]
+
+    def to_local(self, uri: str) -> str:
+        return self.store.to_local(uri)
+
+    @contextlib.contextmanager
+    def installed(self):
+        """Route boto3.client(...) inside the handlers to the local clients."""
+        real = boto3.client
+        boto3.client = self.client
+        try:
+            yield
+        finally:
+            boto3.client = real
+
+
+class AwsBackend:
+    name = "aws"
+
+    def to_local(self, uri: str) -> str:
+        return uri
+
+    @contextlib.contextmanager
+    def installed(self):
+        yield
+
+# ---------- handlers ----------
+
+def load_handler(backend, name: str):
+    """Import lambda/<name>/handler.py as its own module (module-level clients bind to the backend)."""
+    path = os.path.join(REPO, "lambda", name, "handler.py")
+    spec = importlib.util.spec_from_file_location(f"lambda_{name}_handler", path)
+    mod = importlib.util.module_from_spec(spec)
+    with backend.installed():
+        spec.loader.exec_module(mod)
+    return mod
+
+
+def invoke(backend, mod, event: Dict) -> Dict:
+    with backend.installed():
+        return mod.handler(event, None)
+
+# ---------- map: scorer shards ----------
+
+def plan_workers(requested: int, mem_per_shard_gib: float) -> int:
+    hw = detect_hardware()
+    by_mem = int(hw["memory_gib"] // mem_per_shard_gib) if hw["memory_gib"] else hw["cpus"]
+    workers = requested or max(1, min(hw["cpus"], by_mem))
+    print(f"[local] hardware cpus={hw['cpus']} memory={hw['memory_gib']} GiB → {workers} shard worker(s)")
+    return workers
+
+
+def input_args(backend, key: str, export: Dict) -> List[str]:
+    """Scorer input flags: one UNLOAD part, or (direct mode) the query itself."""
+    if export.get("mode") != "direct":
+        return ["--input", backend.to_local(key)]
+    argv = ["--redshift-sql-file", backend.to_local(export["sql_uri"])]
+    if backend.name == "local":
+        return argv + ["--redshift-local-source", backend.source]
+    return argv + ["--redshift-workgroup", export["workgroup"], "--redshift-database", export["database"],
+                   "--redshift-secret-arn", export["secret_arn"]]
+
+
+def run_shards(backend, keys: List[str], run_id: str, data_bucket: str, workers: int,
+               work_dir: str, text_col: str, scorer_args: List[str], export: Dict) -> List[Dict]:
+    cpus = detect_hardware()["cpus"]
+    threads = max(1, cpus // workers)
+    # each shard gets its own cwd (model .cache) so concurrent extracts don't collide
+    slots: "queue.Queue[str]" = queue.Queue()
+    for k in range(workers):
+        d = os.path.join(work_dir, f"slot_{k}")
+        os.makedirs(d, exist_ok=True)
+        slots.put(d)
+
+    def one(index: int, key: str) -> Dict:
+        out_prefix = backend.to_local(f"s3://{data_bucket}/trust_scoring/scored/run_id={run_id}/shard={index}/")
+        if backend.name == "local":
+            os.makedirs(out_prefix, exist_ok=True)
+        cmd = [sys.executable, os.path.join(SPANCAT_DIR, "run_spancat_over_table.py"),
+               *input_args(backend, key, export), "--output-prefix", out_prefix, "--text-col", text_col,
+               "--models-json", os.path.join(SPANCAT_DIR, "models.json"),
+               "--thresholds-json", os.path.join(SPANCAT_DIR, "thresholds.json"),
+               # shards share the box: split the memory target between them
+               "--memory-target", f"{0.8 / workers:.3f}", *scorer_args]
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        slot = slots.get()
+        t0 = time.perf_counter()
+        try:
+            with open(os.path.join(work_dir, f"shard_{index:05d}.log"), "w", encoding="utf-8") as log:
+                code = subprocess.call(cmd, cwd=slot, env=env, stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            slots.put(slot)
+        secs = time.perf_counter() - t0
+        print(f"[local] shard={index} exit={code} {secs:.1f}s ← {key}")
+        return {"index": index, "input": key, "exit_code": code, "seconds": round(secs, 2)}
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(one, i, k) for i, k in enumerate(keys)]
+        for fut in as_completed(futures):
+            results.append(fut.result())
+    return sorted(results, key=lambda r: r["index"])
+
+# ---------- main ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Run export → plan → map → compact → notify locally")
+    parser.add_argument("--backend", choices=["local", "aws"], default="local")
+    parser.add_argument("--root", default=".local_pipeline", help="Local 'S3' root and work dir")
+    parser.add_argument("--source", default="", help="(local) CSV/Parquet standing in for the Redshift query")
+    parser.add_argument("--data-bucket", default="local-data", help="(local) bucket name under --root")
+    parser.add_argument("--unload-slices", type=int, default=4, help="(local) parts written by the fake UNLOAD")
+    parser.add_argument("--run-id", default="")
+    parser.add_argument("--run-date", default="")
+    parser.add_argument("--up-id", type=int, default=7168)
+    parser.add_argument("--up-ids", default="",
+                        help="Batch run: comma-separated up_ids scored together, split per tenant at compaction")
+    parser.add_argument("--email", default="")
+    parser.add_argument("--fast-path-max-rows", type=int, default=None,
+                        help="Runs at or under this many rows skip UNLOAD and stream to one scorer "
+                             "(default: FAST_PATH_MAX_ROWS env, 0 = always UNLOAD)")
+    parser.add_argument("--text-col", default="cleaned_comment")
+    parser.add_argument("--workers", type=int, default=0, help="Concurrent shards (default: sized to the machine)")
+    parser.add_argument("--mem-per-shard-gib", type=float, default=8.0)
+    parser.add_argument("--region", default=os.environ.get("AWS_DEFAULT_REGION", "us-east-2"))
+    parser.add_argument("scorer_args", nargs=argparse.REMAINDER,
+                        help="Extra args for run_spancat_over_table.py (after --)")
+    args = parser.parse_args()
+    scorer_args = [a for a in args.scorer_args if a != "--"]
+
+    if args.backend == "local":
+        if not args.source:
+            parser.error("--source is required with --backend local")
+        backend = LocalBackend(args.root, args.source, args.data_bucket, args.unload_slices)
+    else:
+        backend = AwsBackend()
+
+    os.environ.update(PARAMS)
+    os.environ.setdefault("RS_REGION", args.region)
+    os.environ.setdefault("DB_SECRET_ARN", "redshift-access-creds-us-east-2")
+
+    run_id = args.run_id or f"local-{uuid.uuid4().hex[:8]}"
+    event = {"run_id": run_id, "up_id": args.up_id}
+    if args.up_ids:
+        event = {"run_id": run_id, "up_ids": [int(u) for u in args.up_ids.split(",") if u.strip()]}
+    if args.run_date:
+        event["run_date"] = args.run_date
+    if args.email:
+        event["email"] = args.email
+    if args.fast_path_max_rows is not None:
+        event["fast_path_max_rows"] = args.fast_path_max_rows
+
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    export = invoke(backend, load_handler(backend, "export_redshift"), event)
+    timings["export"] = time.perf_counter() - t0
+
+    if export.get("mode") == "direct":
+        # like the ExportMode Choice: one scorer reads the query result, no plan / Map
+        print(f"[local] export → direct ({export['row_count']} rows)")
+        with backend.installed():
+            data_bucket = boto3.client("ssm").get_parameter(
+                Name=PARAMS["PARAM_DATA_BUCKET"], WithDecryption=True)["Parameter"]["Value"]
+        plan = {"bucket": data_bucket, "keys": [export["mode"]], "count": 1}
+        workers = 1
+    else:
+        print(f"[local] export → {export['s3_prefix']}")
+        t0 = time.perf_counter()
+        plan = invoke(backend, load_handler(backend, "list_inputs"), {"s3_prefix": export["s3_prefix"]})
+        timings["plan"] = time.perf_counter() - t0
+        print(f"[local] plan → {plan['count']} shard(s)")
+        data_bucket = plan["bucket"]
+        workers = plan_workers(args.workers, args.mem_per_shard_gib)
+
+    work_dir = os.path.abspath(os.path.join(args.root, "_work", f"run_id={run_id}"))
+    os.makedirs(work_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    shards = run_shards(backend, plan["keys"], run_id, data_bucket, workers, work_dir, args.text_col,
+                        scorer_args, export)
+    timings["map"] = time.perf_counter() - t0
+
+    # like the state machine: a failed Map iteration fails the run before Compact / Notify
+    failed = [s for s in shards if s["exit_code"] != 0]
+    if not failed:
+        t0 = time.perf_counter()
+        code = subprocess.call([sys.executable, os.path.join(SPANCAT_DIR, "compact_scored.py"),
+                                "--input-prefix", backend.to_local(f"s3://{data_bucket}/trust_scoring/scored/run_id={run_id}/"),
+                                # one run_id=<tenant run_id>/ per up_id under compacted/
+                                "--output-prefix", backend.to_local(f"s3://{data_bucket}/trust_scoring/compacted/"),
+                                "--run-id", run_id, "--tenants-uri", backend.to_local(export["tenants_uri"]),
+                                # and a scored/run_id=<tenant run_id>/ per up_id next to the batch's
+                                "--scored-root", backend.to_local(f"s3://{data_bucket}/trust_scoring/scored/")])
+        timings["compact"] = time.perf_counter() - t0
+        if code != 0:
+            failed.append({"stage": "compact", "exit_code": code})
+
+    if not failed:
+        t0 = time.perf_counter()
+        state = {**event, "Export": {"Payload": export}, "Plan": {"Payload": plan}}
+        invoke(backend, load_handler(backend, "notify"), state)
+        timings["notify"] = time.perf_counter() - t0
+
+    summary = {"run_id": run_id, "backend": backend.name, "workers": workers,
+               "timings_sec": {k: round(v, 2) for k, v in timings.items()},
+               "shards": shards, "failed": len(failed)}
+    with open(os.path.join(work_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print(f"[local] DONE {json.dumps(summary['timings_sec'])} failed={len(failed)} → {work_dir}/summary.json")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os, sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# scorer modules are flat files in the image's /app
+sys.path.insert(0, os.path.join(REPO, "docker", "spancat"))
+# local/run_pipeline.py's backend runs the Lambda handlers against local stand-ins
+sys.path.insert(0, os.path.join(REPO, "local"))
@@ -0,0 +1,99 @@
+import argparse
+
+import pytest
+
+import adaptive_batch
+from adaptive_batch import AdaptiveBatchController, add_memory_args
+
+GIB = 1 << 30
+
+
+@pytest.mark.parametrize("workers", [1, 2, 4, 8])
+def test_split_memory_target_starts(workers):
+    # local/run_pipeline.py splits 0.8 between concurrent shards
+    c = AdaptiveBatchController(target_fraction=round(0.8 / workers, 3), limit_bytes=32 * GIB)
+    assert 0 < c.low_fraction < c.target_fraction
+
+
+def test_from_args_with_split_target():
+    parser = argparse.ArgumentParser()
+    add_memory_args(parser)
+    c = AdaptiveBatchController.from_args(parser.parse_args(["--memory-target", "0.2"]))
+    assert c.low_fraction == pytest.approx(0.15)
+
+
+def test_explicit_low_fraction_must_be_below_target():
+    with pytest.raises(ValueError):
+        AdaptiveBatchController(target_fraction=0.4, low_fraction=0.6, limit_bytes=GIB)
+
+
+def test_batches_cut_by_chars():
+    c = AdaptiveBatchController(batch_size=4, max_batch_chars=10, limit_bytes=GIB)
+    texts = ["a" * 3, "b" * 3, "c" * 3, "d" * 20, "e"]
+    assert list(c.batches(texts)) == [(0, 3), (3, 4), (4, 5)]
+
+
+def test_shrink_after_oom_stops_at_minimum():
+    c = AdaptiveBatchController(batch_size=8, min_batch_size=2, limit_bytes=GIB)
+    assert c.shrink_after_oom(8) and c.batch_size == 4
+    assert not c.shrink_after_oom(2)
+
+
+def test_plan_processes_counts_worker_model_copies():
+    c = AdaptiveBatchController(target_fraction=0.8, limit_bytes=10 * GIB)
+    assert c.plan_processes(4, 1 * GIB) == 1  # footprint unknown
+    c.model_footprint_bytes = 1 * GIB
+    assert c.plan_processes(4, 2 * GIB) == 3  # (8 - 2) // 2
+    assert c.plan_processes(4, 7 * GIB) == 1
+
+
+def test_pipe_batch_size_respects_char_budget():
+    c = AdaptiveBatchController(batch_size=64, max_batch_chars=1000, limit_bytes=GIB)
+    assert c.pipe_batch_size(["x" * 100] * 10) == 10
+    assert c.pipe_batch_size(["x"] * 10) == 64
+
+
+def test_peak_memory_sampler_sees_child_processes():
+    import subprocess, sys
+    from adaptive_batch import PeakMemorySampler, read_tree_memory_bytes
+
+    alone = read_tree_memory_bytes()
+    with PeakMemorySampler(interval_s=0.01) as sampler:
+        # a worker holding ~64 MiB, gone again before the block exits
+        worker = "import time; b = bytearray(64 << 20); b[::4096] = b'x' * 16384; time.sleep(0.5)"
+        subprocess.run([sys.executable, "-c", worker], check=True)
+    assert sampler.peak >= alone + (48 << 20)
+    assert read_tree_memory_bytes() < sampler.peak
+
+
+def _rss(monkeypatch, *values):
+    readings = iter(values)
+    monkeypatch.setattr(adaptive_batch, "read_rss_bytes", lambda: next(readings))
+
+
+def test_observe_holds_when_rss_is_high_but_flat(monkeypatch, capsys):
+    c = AdaptiveBatchController(batch_size=32, min_batch_size=1, target_fraction=0.5, limit_bytes=GIB)
+    _rss(monkeypatch, 600 << 20, 600 << 20, 600 << 20, 600 << 20)
+    c.mark()
+    for _ in range(3):
+        c.observe()
+    assert c.batch_size == 32
+    assert capsys.readouterr().out.count("holding batch_size=32") == 1
+
+
+def test_observe_shrinks_while_rss_grows_and_logs_the_floor(monkeypatch, capsys):
+    c = AdaptiveBatchController(batch_size=4, min_batch_size=2, target_fraction=0.5, limit_bytes=GIB)
+    _rss(monkeypatch, 500 << 20, 540 << 20, 580 << 20, 620 << 20)
+    c.mark()
+    c.observe()
+    assert c.batch_size == 2 and "batch_size 4 -> 2 (min_batch_size)" in capsys.readouterr().out
+    c.observe()
+    assert c.batch_size == 2 and "still growing at min_batch_size=2" in capsys.readouterr().out
+
+
+def test_observe_grows_below_low_watermark(monkeypatch):
+    c = AdaptiveBatchController(batch_size=10, target_fraction=0.8, limit_bytes=GIB)
+    _rss(monkeypatch, 100 << 20, 100 << 20)
+    c.mark()
+    c.observe()
+    assert c.batch_size == 15
@@ -0,0 +1,92 @@
+import datetime
+import json
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from compact_scored import compact, compact_tenants, main
+
+
+def _shard(path, up_ids, keys, dates, themes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.table({
+        "up_id": pa.array(up_ids, pa.int64()),
+        "comment_unique_key": keys,
+        "posted_date": dates,
+        "theme": themes,
+        "score": [0.9] * len(keys),
+    }), path)
+
+
+def _scored(tmp_path):
+    scored = tmp_path / "scored" / "run_id=r"
+    d1, d2 = datetime.date(2025, 1, 1), datetime.date(2025, 1, 2)
+    _shard(scored / "shard=0" / "part.parquet", [7, 7, 9], ["k3", "k1", "k2"], [d1, d1, d2], ["a", "a", "b"])
+    _shard(scored / "shard=1" / "part.parquet", [9], ["k4"], [d2], ["b"])
+    # a shard with no spans is written without columns
+    pq.write_table(pa.table({}), scored / "shard=2.parquet")
+    return str(scored) + "/"
+
+
+def test_compact_partitions_and_sorts(tmp_path):
+    out = tmp_path / "compacted"
+    m = compact(_scored(tmp_path), str(out), run_id="r1")
+    assert m["rows"] == 4 and m["source_files"] == 3
+    assert {(f["partition"]["posted_date"], f["partition"]["theme"]) for f in m["files"]} == {
+        ("2025-01-01", "a"), ("2025-01-02", "b")}
+    part = pq.read_table(out / "posted_date=2025-01-01" / "theme=a" / "part-00000.parquet")
+    assert part["comment_unique_key"].to_pylist() == ["k1", "k3"]
+    assert "posted_date" not in part.column_names and "theme" not in part.column_names
+    assert json.loads((out / "manifest.json").read_text())["run_id"] == "r1"
+
+
+def test_compact_tenants_splits_by_up_id(tmp_path):
+    out = tmp_path / "compacted"
+    tenants = [{"up_id": 7, "run_id": "r-up7"}, {"up_id": 9, "run_id": "r-up9"}, {"up_id": 11, "run_id": "r-up11"}]
+    manifests = compact_tenants(_scored(tmp_path), str(out), tenants)
+    assert [(m["up_id"], m["rows"]) for m in manifests] == [(7, 2), (9, 2), (11, 0)]
+    part = pq.read_table(out / "run_id=r-up9" / "posted_date=2025-01-02" / "theme=b" / "part-00000.parquet")
+    assert part["comment_unique_key"].to_pylist() == ["k2", "k4"]
+    assert "up_id" not in part.column_names
+    assert (out / "run_id=r-up11" / "manifest.json").exists()
+
+
+def test_cli_reads_tenants_from_file(tmp_path, monkeypatch):
+    tenants = tmp_path / "tenants.json"
+    tenants.write_text(json.dumps([{"up_id": 7, "run_id": "r-up7"}]))
+    out = tmp_path / "compacted"
+    monkeypatch.setattr(sys, "argv", ["compact_scored.py", "--input-prefix", _scored(tmp_path),
+                                      "--output-prefix", str(out), "--tenants-uri", str(tenants)])
+    main()
+    assert json.loads((out / "run_id=r-up7" / "manifest.json").read_text())["rows"] == 2
+
+
+def test_compact_tenants_writes_per_tenant_scored_prefixes(tmp_path):
+    scored_root = tmp_path / "scored"
+    tenants = [{"up_id": 7, "run_id": "r-up7"}, {"up_id": 9, "run_id": "r-up9"}]
+    manifests = compact_tenants(_scored(tmp_path), str(tmp_path / "compacted"), tenants, scored_root=str(scored_root))
+    assert manifests[1]["scored_prefix"] == f"{scored_root}/run_id=r-up9/"
+    assert sorted(p.relative_to(scored_root / "run_id=r-up9").as_posix()
+                  for p in (scored_root / "run_id=r-up9").rglob("*.parquet")) == ["shard=0/part.parquet",
+                                                                                  "shard=1/part.parquet"]
+    assert pq.read_table(scored_root / "run_id=r-up9" / "shard=0" / "part.parquet")["up_id"].to_pylist() == [9]
+    assert not (scored_root / "run_id=r-up7" / "shard=1").exists()
+    # the batch's own prefix is left as it was
+    assert pq.read_table(scored_root / "run_id=r" / "shard=0" / "part.parquet").num_rows == 3
+
+
+def test_single_tenant_scored_prefix_is_the_input(tmp_path):
+    input_prefix = _scored(tmp_path)
+    compact_tenants(input_prefix, str(tmp_path / "compacted"), [{"up_id": 7, "run_id": "r"}],
+                    scored_root=str(tmp_path / "scored"))
+    assert pq.read_table(tmp_path / "scored" / "run_id=r" / "shard=0" / "part.parquet").num_rows == 3
+
+
+def test_profiled_shards_are_skipped_and_flagged(tmp_path):
+    input_prefix = _scored(tmp_path)
+    profile = tmp_path / "scored" / "run_id=r" / "shard=1" / "_profile"
+    _shard(profile / "partial" / "part_00001.parquet", [9], ["k9"], [datetime.date(2025, 1, 3)], ["c"])
+    (profile / "PARTIAL.json").write_text(json.dumps({"sample_profile_rows": 1}))
+    m = compact(input_prefix, str(tmp_path / "compacted"))
+    assert m["rows"] == 4 and m["partial_shards"] == ["shard=1"]
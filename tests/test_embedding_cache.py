@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, consolidate, normalize_text
+
+DIM = 8
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, **_):
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        self.calls += len(texts)
+        out = np.array([[len(t) + i for i in range(DIM)] for t in texts], dtype=np.float32)
+        return out[0] if single else out
+
+
+def _vectors_bytes(cache):
+    return os.path.getsize(os.path.join(cache.dir, "vectors.f32"))
+
+
+def test_file_grows_with_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "m", max_entries=200_000)
+    cache.encode(["a", "bb"], FakeEncoder())
+    cache.save()
+    assert _vectors_bytes(cache) == 1024 * DIM * 4
+    cache.encode([f"t{i}" for i in range(3000)], FakeEncoder())
+    assert 3002 <= _vectors_bytes(cache) // (DIM * 4) <= 4096
+
+
+def test_hits_reload_and_eviction(tmp_path):
+    enc = FakeEncoder()
+    cache = EmbeddingCache(str(tmp_path), "m", max_entries=10)
+    cache.encode(["Hello  World", "hello world"], enc)
+    cache.encode([" HELLO world"], enc)
+    assert enc.calls == 1 and cache.hits == 1
+    cache.encode([f"x{i}" for i in range(12)], enc)
+    assert len(cache) <= 10
+    cache.save()
+    again = EmbeddingCache(str(tmp_path), "m", max_entries=10)
+    assert len(again) == len(cache)
+    assert normalize_text("X11") in again._entries
+
+
+def test_parallel_pushes_merge_and_consolidate(tmp_path):
+    remote = str(tmp_path / "remote")
+    a = EmbeddingCache(str(tmp_path / "a"), "m", s3_prefix=remote)
+    b = EmbeddingCache(str(tmp_path / "b"), "m", s3_prefix=remote)
+    a.encode(["one", "shared"], FakeEncoder())
+    b.encode(["two", "shared"], FakeEncoder())
+    a.push()
+    b.push()
+
+    # a later shard sees both shards' entries without encoding anything
+    enc = FakeEncoder()
+    c = EmbeddingCache(str(tmp_path / "c"), "m", s3_prefix=remote)
+    c.encode(["one", "two", "shared"], enc)
+    assert enc.calls == 0
+
+    assert consolidate(remote, "m") == 3
+    assert not os.listdir(os.path.join(remote, "m", "deltas"))
+    d = EmbeddingCache(str(tmp_path / "d"), "m", s3_prefix=remote)
+    assert len(d) == 3
+    d.push()  # nothing new → no delta
+    assert not os.listdir(os.path.join(remote, "m", "deltas"))
+
+
+def test_misses_encode_the_original_text(tmp_path):
+    seen = []
+
+    class RecordingEncoder(FakeEncoder):
+        def encode(self, texts, **kw):
+            seen.extend([texts] if isinstance(texts, str) else texts)
+            return super().encode(texts, **kw)
+
+    cache = EmbeddingCache(str(tmp_path), "cased-model")
+    cache.encode(["Hello  World", "hello world", "NHS"], RecordingEncoder())
+    assert seen == ["Hello  World", "NHS"]
+    assert set(cache._entries) == {"hello world", "nhs"}
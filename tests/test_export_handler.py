@@ -0,0 +1,75 @@
+import datetime
+import json
+
+import pandas as pd
+import pytest
+
+from redshift_source import FileRedshiftData
+from run_pipeline import PARAMS, LocalBackend, invoke, load_handler
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "src.parquet"
+    pd.DataFrame({
+        "comment_unique_key": [f"k{i}" for i in range(5)],
+        "posted_date": [datetime.date(2025, 1, 1)] * 5,
+        "cleaned_comment": ["text"] * 5,
+    }).to_parquet(path)
+    return str(path)
+
+
+@pytest.fixture
+def backend(tmp_path, source, monkeypatch):
+    for name, value in {**PARAMS, "RS_REGION": "us-east-2", "DB_SECRET_ARN": "creds",
+                        "FAST_PATH_MAX_ROWS": "20000"}.items():
+        monkeypatch.setenv(name, value)
+    return LocalBackend(str(tmp_path / "root"), source, "local-data", slices=2)
+
+
+@pytest.fixture
+def handler(backend):
+    return load_handler(backend, "export_redshift")
+
+
+@pytest.fixture
+def export(backend, handler):
+    return lambda event: invoke(backend, handler, {"run_id": "r1", "run_date": "2025-01-02", **event})
+
+
+def test_small_run_goes_direct_under_env_threshold(export):
+    out = export({"up_id": 7168})
+    assert out["mode"] == "direct" and out["row_count"] == 5
+
+
+def test_zero_in_event_always_unloads(export):
+    out = export({"up_id": 7168, "fast_path_max_rows": 0})
+    assert out["mode"] == "unload"
+    assert out["s3_prefix"].endswith("/run_id=r1/")
+
+
+def test_event_threshold_below_row_count_unloads(export):
+    assert export({"up_id": 7168, "fast_path_max_rows": 4})["mode"] == "unload"
+
+
+def test_bounded_count_stops_at_limit(handler, source):
+    rs = FileRedshiftData(source)
+    sql = handler._tagged_sql("SELECT * FROM t WHERE f.up_id = {UP_ID}", [7168, 1234], "2025-01-02")
+    for limit, expected in ((4, 4), (11, 10)):
+        sid = rs.execute_statement(Sql=handler._count_sql(sql, limit))["Id"]
+        assert rs.get_statement_result(Id=sid)["Records"] == [[{"longValue": expected}]]
+
+
+def test_tagged_sql_keeps_dashes_inside_literals(handler):
+    template = "SELECT * FROM t -- tenant\nWHERE c LIKE '%--%' AND d = 'it''s -- fine' AND f.up_id = {UP_ID}; -- end"
+    sql = handler._tagged_sql(template, [7168], "2025-01-02")
+    assert "LIKE '%--%' AND d = 'it''s -- fine' AND f.up_id = 7168\n) AS q" in sql
+    assert "tenant" not in sql and "end" not in sql
+
+
+def test_tenants_are_written_to_s3_for_compaction(export, backend):
+    out = export({"up_ids": [7168, 1234], "fast_path_max_rows": 0})
+    assert out["tenants_uri"] == "s3://local-data/trust_scoring/queries/run_id=r1/tenants.json"
+    with open(backend.to_local(out["tenants_uri"]), encoding="utf-8") as f:
+        assert json.load(f) == out["tenants"] == [{"up_id": 1234, "run_id": "r1-up1234"},
+                                                  {"up_id": 7168, "run_id": "r1-up7168"}]
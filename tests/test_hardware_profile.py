@@ -0,0 +1,24 @@
+from hardware_profile import detect_hardware, load_profile, profile_key, save_profile, settings_for
+
+HW = {"cpus": 8, "memory_gib": 32}
+
+
+def test_profile_round_trip(tmp_path):
+    assert load_profile(str(tmp_path), HW) is None
+    path = save_profile(str(tmp_path), HW, {"batch_size": 32}, {"trust": {"n_process": 2}})
+    assert path.endswith("cpu8-mem32g.json")
+    assert load_profile(str(tmp_path), HW)["models"] == {"trust": {"n_process": 2}}
+
+
+def test_settings_for_merges_default_and_drops_unknown_keys():
+    profile = {"default": {"batch_size": 32, "torch_threads": 4},
+               "models": {"trust": {"batch_size": 64, "note": "ignored"}}}
+    assert settings_for(profile, "trust") == {"torch_threads": 4, "batch_size": 64}
+    assert settings_for(profile, "other") == {"torch_threads": 4, "batch_size": 32}
+    assert settings_for(None, "trust") == {}
+
+
+def test_detect_hardware_key():
+    hw = detect_hardware()
+    assert hw["cpus"] >= 1
+    assert profile_key(hw) == f"cpu{hw['cpus']}-mem{hw['memory_gib']}g"
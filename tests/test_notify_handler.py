@@ -0,0 +1,30 @@
+import json
+
+from run_pipeline import PARAMS, LocalBackend, invoke, load_handler
+
+
+def test_batch_tenants_point_at_their_own_prefixes(tmp_path, monkeypatch):
+    for name, value in PARAMS.items():
+        monkeypatch.setenv(name, value)
+    backend = LocalBackend(str(tmp_path / "root"), str(tmp_path / "unused.csv"), "local-data", slices=1)
+    export = {"mode": "unload", "run_id": "r", "run_date": "2025-01-02", "s3_prefix": "s3://local-data/raw/",
+              "tenants": [{"up_id": 7, "run_id": "r-up7"}, {"up_id": 9, "run_id": "r-up9"}]}
+    out = invoke(backend, load_handler(backend, "notify"), {"Export": {"Payload": export}})
+    first = out["messages"][0]
+    assert first["scored_prefix"] == "s3://local-data/trust_scoring/scored/run_id=r-up7/"
+    assert first["compacted_prefix"] == "s3://local-data/trust_scoring/compacted/run_id=r-up7/"
+    assert first["batch_scored_prefix"] == "s3://local-data/trust_scoring/scored/run_id=r/"
+
+
+def test_partial_run_is_flagged(tmp_path, monkeypatch):
+    for name, value in PARAMS.items():
+        monkeypatch.setenv(name, value)
+    backend = LocalBackend(str(tmp_path / "root"), str(tmp_path / "unused.csv"), "local-data", slices=1)
+    manifest = tmp_path / "root" / "local-data" / "trust_scoring" / "compacted" / "run_id=r" / "manifest.json"
+    manifest.parent.mkdir(parents=True)
+    manifest.write_text(json.dumps({"rows": 3, "partial_shards": ["shard=1"]}))
+    export = {"run_id": "r", "run_date": "2025-01-02", "tenants": [{"up_id": 7, "run_id": "r"}]}
+    out = invoke(backend, load_handler(backend, "notify"), {"Export": {"Payload": export}})
+    assert out["messages"][0]["partial_shards"] == ["shard=1"]
+    with open(tmp_path / "root" / "notifications.jsonl", encoding="utf-8") as f:
+        assert json.loads(f.readline())["Subject"].startswith("Trust scoring PARTIAL")
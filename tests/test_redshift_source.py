@@ -0,0 +1,62 @@
+import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+from redshift_source import FileRedshiftData, count_sql, read_query, strip_statement
+
+TAGGED = """SELECT CAST(7168 AS BIGINT) AS up_id, q.* FROM (
+SELECT * FROM t WHERE f.up_id = 7168
+) AS q
+UNION ALL
+SELECT CAST(1234 AS BIGINT) AS up_id, q.* FROM (
+SELECT * FROM t WHERE f.up_id = 1234
+) AS q"""
+
+
+def _source(tmp_path, with_up_id: bool) -> str:
+    df = pd.DataFrame({
+        "comment_unique_key": [f"k{i}" for i in range(5)],
+        "posted_date": [datetime.date(2025, 1, 1 + i) for i in range(5)],
+        "cleaned_comment": ["text"] * 5,
+    })
+    if with_up_id:
+        df["up_id"] = [7168, 7168, 1234, 5, 5]
+    path = tmp_path / "src.parquet"
+    df.to_parquet(path)
+    return str(path)
+
+
+def test_paged_result_keeps_types(tmp_path):
+    rs = FileRedshiftData(_source(tmp_path, with_up_id=False), page_size=2)
+    t = read_query("SELECT * FROM t;", rs=rs)
+    assert t.num_rows == 5
+    assert t.schema.field("posted_date").type == pa.date32()
+
+
+def test_tagged_sql_without_up_id_column_is_tagged_per_tenant(tmp_path):
+    rs = FileRedshiftData(_source(tmp_path, with_up_id=False))
+    t = read_query(TAGGED, rs=rs)
+    assert t.column_names[0] == "up_id"
+    assert t["up_id"].to_pylist() == [7168] * 5 + [1234] * 5
+
+
+def test_tagged_sql_filters_up_id_column(tmp_path):
+    rs = FileRedshiftData(_source(tmp_path, with_up_id=True))
+    assert sorted(read_query(TAGGED, rs=rs)["up_id"].to_pylist()) == [1234, 7168, 7168]
+    sid = rs.execute_statement(Sql=count_sql(TAGGED))["Id"]
+    assert rs.get_statement_result(Id=sid)["Records"] == [[{"longValue": 3}]]
+
+
+def test_unload_writes_tagged_parts(tmp_path):
+    rs = FileRedshiftData(_source(tmp_path, with_up_id=False), slices=2)
+    prefix = tmp_path / "raw" / "batch_"
+    rs.execute_statement(Sql=f"UNLOAD ($${TAGGED}$$) TO '{prefix}' FORMAT AS PARQUET")
+    parts = sorted((tmp_path / "raw").glob("*.parquet"))
+    assert len(parts) == 2
+    assert set(pd.concat(pd.read_parquet(p) for p in parts)["up_id"]) == {7168, 1234}
+
+
+
+def test_strip_statement_keeps_dashes_inside_literals():
+    assert strip_statement("SELECT '--x' AS a, \"b--c\" -- note\nFROM t;  -- end\n") == "SELECT '--x' AS a, \"b--c\" \nFROM t"
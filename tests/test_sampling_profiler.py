@@ -0,0 +1,27 @@
+import time
+
+from sampling_profiler import SamplingProfiler, profile_dir_for
+
+
+def _busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_samples_main_thread_hotspot():
+    with SamplingProfiler(interval=0.005) as prof:
+        _busy_wait(0.3)
+    assert prof.ticks > 0
+    own, incl = prof.hotspots()
+    assert any(frame.startswith("_busy_wait ") for frame, _ in own)
+    line = next(l for l in prof.collapsed().splitlines() if "_busy_wait" in l)
+    stack, count = line.rsplit(" ", 1)
+    assert stack.startswith("MainThread;") and int(count) > 0
+    assert "MainThread – top" in prof.summary()
+
+
+def test_profile_dir_for():
+    assert profile_dir_for("s3://b/scored/run_id=r/shard=0/") == "s3://b/scored/run_id=r/shard=0/_profile"
+    assert profile_dir_for("out/scored.parquet") == "out/_profile"
+    assert profile_dir_for("scored.parquet") == "_profile"
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("spacy")
+
+from adaptive_batch import AdaptiveBatchController
+from run_spancat_over_table import _score_batch
+
+GIB = 1 << 30
+
+
+class _Doc:
+    def __init__(self, text):
+        self.text = text
+        self.spans = {}
+
+
+class _OomNlp:
+    """nlp.pipe stand-in: MemoryError for any batch of more than `max_rows` or containing "boom"."""
+
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.scored = []
+
+    def pipe(self, texts, batch_size=None):
+        if len(texts) > self.max_rows or "boom" in texts:
+            raise MemoryError
+        self.scored += texts
+        return [_Doc(t) for t in texts]
+
+
+def test_memory_error_splits_to_single_rows_below_min_batch_size(capsys):
+    controller = AdaptiveBatchController(batch_size=8, min_batch_size=8, limit_bytes=GIB)
+    nlp = _OomNlp(max_rows=1)
+    texts = ["a", "b", "boom", "c", "d", "e", "f", "g"]
+    _score_batch(nlp, "theme", 0.5, texts, [{}] * len(texts), 0, len(texts), set(), "2025-01-01", [], controller)
+    assert nlp.scored == ["a", "b", "c", "d", "e", "f", "g"]
+    warnings = [line for line in capsys.readouterr().out.splitlines() if line.startswith("[warn]")]
+    assert warnings == ["[warn] theme: skipping row 2 (4 chars) after MemoryError"]